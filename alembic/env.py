@@ -29,7 +29,7 @@ target_metadata = Base.metadata
 # ... etc.
 
 # Override the sqlalchemy.url with our own from settings
-config.set_main_option("sqlalchemy.url", str(settings.DATABASE_URI))
+config.set_main_option("sqlalchemy.url", settings.DATABASE_URI_STR)
 
 
 def run_migrations_offline() -> None:
@@ -0,0 +1,28 @@
+"""Composite indexes for conversation listing and provider lookups
+
+Revision ID: composite_index_migration
+Revises: uuid_server_default_migration
+Create Date: 2025-07-17 10:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'composite_index_migration'
+down_revision = 'uuid_server_default_migration'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # (user_id, updated_at) also covers lookups on user_id alone
+    op.create_index('ix_conversations_user_updated', 'conversations',
+                    ['user_id', 'updated_at'])
+    op.drop_index('ix_conversations_user_id', table_name='conversations')
+    op.create_index('ix_auth_providers_user_id', 'auth_providers', ['user_id'])
+
+
+def downgrade():
+    op.drop_index('ix_auth_providers_user_id', table_name='auth_providers')
+    op.create_index('ix_conversations_user_id', 'conversations', ['user_id'])
+    op.drop_index('ix_conversations_user_updated', table_name='conversations')
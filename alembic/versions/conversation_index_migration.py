@@ -0,0 +1,25 @@
+"""Index conversations by owner
+
+Revision ID: conversation_index_migration
+Revises: user_auth_migration
+Create Date: 2025-07-10 10:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'conversation_index_migration'
+down_revision = 'user_auth_migration'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Back the per-user conversation listing. The auth_providers lookup on
+    # (provider_type, provider_user_id) is already served by the unique
+    # index behind the unique_provider_account constraint.
+    op.create_index('ix_conversations_user_id', 'conversations', ['user_id'])
+
+
+def downgrade():
+    op.drop_index('ix_conversations_user_id', table_name='conversations')
@@ -0,0 +1,41 @@
+"""Add the id to the listing indexes as the keyset tie-breaker
+
+Revision ID: keyset_index_migration
+Revises: server_timestamp_migration
+Create Date: 2025-07-21 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'keyset_index_migration'
+down_revision = 'server_timestamp_migration'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Pages are ordered by (timestamp, id), so the indexes end with the id
+    # to keep each page a single index range scan
+    op.drop_index('ix_conversations_user_updated', table_name='conversations')
+    op.create_index('ix_conversations_user_updated', 'conversations',
+                    ['user_id', 'updated_at', 'id'])
+    op.drop_index('ix_messages_conv_created', table_name='messages')
+    op.create_index(
+        'ix_messages_conv_created',
+        'messages',
+        ['conversation_id', sa.text('created_at DESC'), sa.text('id DESC')],
+    )
+
+
+def downgrade():
+    op.drop_index('ix_messages_conv_created', table_name='messages')
+    op.create_index(
+        'ix_messages_conv_created',
+        'messages',
+        ['conversation_id', sa.text('created_at DESC')],
+    )
+    op.drop_index('ix_conversations_user_updated', table_name='conversations')
+    op.create_index('ix_conversations_user_updated', 'conversations',
+                    ['user_id', 'updated_at'])
@@ -0,0 +1,28 @@
+"""Index messages by conversation and creation time
+
+Revision ID: message_index_migration
+Revises: conversation_index_migration
+Create Date: 2025-07-14 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'message_index_migration'
+down_revision = 'conversation_index_migration'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Lets the recent history window be read as one index range scan
+    op.create_index(
+        'ix_messages_conv_created',
+        'messages',
+        ['conversation_id', sa.text('created_at DESC')],
+    )
+
+
+def downgrade():
+    op.drop_index('ix_messages_conv_created', table_name='messages')
@@ -0,0 +1,52 @@
+"""Server-side, timezone-aware timestamps
+
+Revision ID: server_timestamp_migration
+Revises: composite_index_migration
+Create Date: 2025-07-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'server_timestamp_migration'
+down_revision = 'composite_index_migration'
+branch_labels = None
+depends_on = None
+
+# Each column with the nullability it had before this migration
+COLUMNS = (
+    ('users', 'created_at', True),
+    ('users', 'updated_at', True),
+    ('auth_providers', 'created_at', True),
+    ('conversations', 'created_at', False),
+    ('conversations', 'updated_at', False),
+    ('messages', 'created_at', False),
+)
+
+
+def upgrade():
+    for table, column, _ in COLUMNS:
+        # Existing values were written with datetime.utcnow()
+        op.execute(
+            f'UPDATE {table} SET {column} = now() AT TIME ZONE \'UTC\' '
+            f'WHERE {column} IS NULL'
+        )
+        op.alter_column(
+            table, column,
+            type_=sa.DateTime(timezone=True),
+            postgresql_using=f"{column} AT TIME ZONE 'UTC'",
+            server_default=sa.func.now(),
+            nullable=False,
+        )
+
+
+def downgrade():
+    for table, column, nullable in COLUMNS:
+        op.alter_column(
+            table, column,
+            type_=sa.DateTime(),
+            postgresql_using=f"{column} AT TIME ZONE 'UTC'",
+            server_default=None,
+            nullable=nullable,
+        )
@@ -1,7 +1,7 @@
 """User authentication tables
 
 Revision ID: user_auth_migration
-Revises: initial_migration
+Revises: 001
 Create Date: 2025-07-03 09:17:00.000000
 
 """
@@ -11,7 +11,7 @@ from sqlalchemy.dialects import postgresql
 
 # revision identifiers, used by Alembic.
 revision = 'user_auth_migration'
-down_revision = 'initial_migration'
+down_revision = '001'
 branch_labels = None
 depends_on = None
 
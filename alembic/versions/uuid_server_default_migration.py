@@ -0,0 +1,38 @@
+"""Generate primary key UUIDs in the database
+
+Revision ID: uuid_server_default_migration
+Revises: message_index_migration
+Create Date: 2025-07-16 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'uuid_server_default_migration'
+down_revision = 'message_index_migration'
+branch_labels = None
+depends_on = None
+
+TABLES = ('users', 'auth_providers', 'conversations', 'messages')
+
+
+def upgrade():
+    # gen_random_uuid() is built in from PostgreSQL 13; pgcrypto provides it
+    # on older servers
+    op.execute("""
+        DO $$
+        BEGIN
+            IF current_setting('server_version_num')::int < 130000 THEN
+                CREATE EXTENSION IF NOT EXISTS pgcrypto;
+            END IF;
+        END
+        $$
+    """)
+    for table in TABLES:
+        op.alter_column(table, 'id', server_default=sa.text('gen_random_uuid()'))
+
+
+def downgrade():
+    for table in TABLES:
+        op.alter_column(table, 'id', server_default=None)
@@ -1,50 +1,140 @@
+import hashlib
+import logging
+import threading
 import time
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from cachetools import TTLCache
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request
 from fastapi.responses import RedirectResponse
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
 from typing import Optional
-import requests
+from urllib.parse import urlencode
+import uuid
 
 from app.db.session import get_db
 from app.models.user import User, AuthProvider
-from app.schemas.auth import AuthRequest, AuthResponse, TokenPayload
+from app.schemas.auth import AuthRequest, AuthResponse
 from app.services.auth import create_access_token, verify_google_token, verify_apple_token
 from app.core.config import settings
+from app.core.http import http_client
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token")
 
+# Verified tokens, keyed by a digest of the token (never the raw token),
+# mapped to their (sub, exp) claims
+_token_cache = TTLCache(maxsize=10000, ttl=settings.AUTH_CACHE_TTL)
+_token_cache_lock = threading.Lock()
+
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+def decode_access_token(token: str) -> Optional[str]:
     """
-    Get the current authenticated user
+    Decode an access token and return its subject (the user ID)
+
+    Recently verified tokens are served from an in-memory TTL cache so that
+    repeated requests with the same token skip the signature verification.
+    Raises JWTError if the token is invalid or expired.
+    """
+    cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    with _token_cache_lock:
+        cached = _token_cache.get(cache_key)
+
+    if cached is not None:
+        user_id, exp = cached
+        if exp is not None and exp < time.time():
+            raise JWTError("Signature has expired.")
+        return user_id
+
+    # Reject expired tokens from the unverified claims before paying for
+    # the signature check
+    exp = jwt.get_unverified_claims(token).get("exp")
+    if isinstance(exp, (int, float)) and exp < time.time():
+        raise JWTError("Signature has expired.")
+
+    payload = jwt.decode(token, settings.SECRET_KEY,
+                         algorithms=[settings.ALGORITHM])
+    user_id: Optional[str] = payload.get("sub")
+    if user_id is not None:
+        with _token_cache_lock:
+            _token_cache[cache_key] = (user_id, payload.get("exp"))
+    return user_id
+
+
+def _decode_user_id(token: str) -> Optional[uuid.UUID]:
+    """
+    Resolve an access token to the ID of its user, or None if the token is not valid
+    """
+    try:
+        user_id = decode_access_token(token)
+    except JWTError:
+        return None
+    if not isinstance(user_id, str):
+        return None
+
+    try:
+        return uuid.UUID(user_id)
+    except ValueError:
+        return None
+
+
+async def _decode_and_lookup(token: str, db: AsyncSession) -> Optional[User]:
     """
-    credentials_exception = HTTPException(
+    Resolve an access token to its user, or None if the token is not valid
+    """
+    user_id = _decode_user_id(token)
+    if user_id is None:
+        return None
+
+    result = await db.execute(select(User).where(User.id == user_id))
+    return result.scalars().first()
+
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY,
-                             algorithms=[settings.ALGORITHM])
-        user_id: Optional[str] = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-        token_payload = TokenPayload(sub=user_id)
-    except JWTError:
-        raise credentials_exception
 
-    user = db.query(User).filter(User.id == token_payload.sub).first()
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> User:
+    """
+    Get the current authenticated user
+    """
+    user = await _decode_and_lookup(token, db)
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     return user
 
 
+async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> uuid.UUID:
+    """
+    Get the ID of the current authenticated user without loading the user row.
+    Use this when the user ID is all a route needs, e.g. for ownership checks.
+    """
+    user_id = _decode_user_id(token)
+    if user_id is None:
+        raise _credentials_exception()
+    return user_id
+
+
+async def get_current_user_id_ws(token: str = Query(...)) -> Optional[uuid.UUID]:
+    """
+    Get the ID of the user authenticated by the token query parameter of a
+    WebSocket connection, or None so the handler can report the error over
+    the socket
+    """
+    return _decode_user_id(token)
+
+
 @router.get("/callbacks/sign_in_with_apple")
-async def apple_callback(request: Request, code: str = None, state: str = None, db: Session = Depends(get_db)):
+async def apple_callback(request: Request, code: str = None, state: str = None, db: AsyncSession = Depends(get_db)):
     """
     Handle the callback from Apple Sign-In for web authentication
     """
@@ -66,19 +156,21 @@ async def apple_callback(request: Request, code: str = None, state: str = None,
         user_info = await verify_apple_token(id_token)
 
         # Create or get user
-        user = await get_or_create_apple_user(user_info, db)
+        user_id = await get_or_create_apple_user(user_info, db)
 
         # Generate JWT token
-        access_token = create_access_token(data={"sub": str(user.id)})
+        access_token = create_access_token(data={"sub": str(user_id)})
 
         # Redirect to the frontend with the token
         # You can use a custom URL scheme or a specific page in your app
-        frontend_url = f"https://sway.teja.app/#/auth-callback?token={access_token}&user_id={user.id}"
+        frontend_url = "https://sway.teja.app/#/auth-callback?" + urlencode(
+            {"token": access_token, "user_id": str(user_id)}
+        )
         return RedirectResponse(url=frontend_url)
 
-    except Exception as e:
+    except Exception:
         # Log the error
-        print(f"Apple callback error: {e}")
+        logger.exception("Apple callback error")
         # Redirect to error page
         return RedirectResponse(url="https://sway.teja.app/#/auth-error")
 
@@ -98,7 +190,7 @@ async def exchange_apple_code_for_token(code: str):
         "redirect_uri": "https://sai.teja.app/api/auth/callbacks/sign_in_with_apple"
     }
 
-    response = requests.post(
+    response = await http_client.post(
         "https://appleid.apple.com/auth/token",
         data=token_request_data
     )
@@ -110,6 +202,15 @@ async def exchange_apple_code_for_token(code: str):
     return response.json()
 
 
+# The signed client secret is valid for 180 days, so it is generated once and
+# reused until it is within an hour of expiring
+_APPLE_SECRET_LIFETIME = 86400 * 180
+_APPLE_SECRET_REFRESH_MARGIN = 3600
+_apple_secret_cache = {"secret": None, "exp": 0}
+_apple_private_key: Optional[str] = None
+_apple_secret_lock = threading.Lock()
+
+
 def generate_apple_client_secret():
     """
     Generate the client secret for Apple Sign-In
@@ -119,72 +220,117 @@ def generate_apple_client_secret():
     - Your Apple Services ID (client_id)
     - Your private key ID from Apple
     - Your private key file
+
+    The secret is cached and only re-signed when it is close to expiring.
     """
+    global _apple_private_key
+
     # Current time
     now = int(time.time())
 
-    # Prepare the token payload
-    payload = {
-        'iss': settings.APPLE_TEAM_ID,
-        'iat': now,
-        'exp': now + 86400 * 180,  # 180 days
-        'aud': 'https://appleid.apple.com',
-        'sub': settings.APPLE_CLIENT_ID,
-    }
-
-    # Read the private key
-    with open(settings.APPLE_PRIVATE_KEY_PATH, 'r') as key_file:
-        private_key = key_file.read()
-
-    # Create the client secret
-    client_secret = jwt.encode(
-        payload,
-        private_key,
-        algorithm='ES256',
-        headers={
-            'kid': settings.APPLE_KEY_ID
+    with _apple_secret_lock:
+        if now < _apple_secret_cache["exp"] - _APPLE_SECRET_REFRESH_MARGIN:
+            return _apple_secret_cache["secret"]
+
+        # Prepare the token payload
+        exp = now + _APPLE_SECRET_LIFETIME
+        payload = {
+            'iss': settings.APPLE_TEAM_ID,
+            'iat': now,
+            'exp': exp,
+            'aud': 'https://appleid.apple.com',
+            'sub': settings.APPLE_CLIENT_ID,
         }
-    )
 
-    return client_secret
+        # Read the private key once
+        if _apple_private_key is None:
+            with open(settings.APPLE_PRIVATE_KEY_PATH, 'r') as key_file:
+                _apple_private_key = key_file.read()
+
+        # Create the client secret
+        client_secret = jwt.encode(
+            payload,
+            _apple_private_key,
+            algorithm='ES256',
+            headers={
+                'kid': settings.APPLE_KEY_ID
+            }
+        )
 
+        _apple_secret_cache["secret"] = client_secret
+        _apple_secret_cache["exp"] = exp
 
-async def get_or_create_apple_user(user_info, db: Session):
-    """
-    Get existing user or create a new one based on Apple user info
+        return client_secret
+
+
+# Built once so sign-ins skip statement construction and always hit the
+# compiled statement cache
+_provider_user_id_stmt = select(AuthProvider.user_id).where(
+    AuthProvider.provider_type == bindparam("provider_type"),
+    AuthProvider.provider_user_id == bindparam("provider_user_id"),
+)
+
+
+async def get_or_create_provider_user_id(
+    db: AsyncSession, provider_type: str, provider_user_id: str, email: Optional[str]
+) -> uuid.UUID:
     """
-    provider_user_id = user_info["provider_user_id"]
-    email = user_info.get("email")
+    Get the ID of the user linked to a provider account, creating the user
+    and the provider link if the account is new.
 
+    New accounts are written with INSERT ... ON CONFLICT so that two
+    concurrent first sign-ins for the same account cannot fail on the unique
+    constraint: the request that loses the race rolls back the user it
+    created and returns the ID of the user that won.
+    """
     # Check if this provider account exists
-    auth_provider = db.query(AuthProvider).filter(
-        AuthProvider.provider_type == "apple",
-        AuthProvider.provider_user_id == provider_user_id
-    ).first()
-
-    if auth_provider:
-        # User exists, return user
-        return auth_provider.user
-    else:
-        # Create new user and auth provider
-        user = User()
-        db.add(user)
-        db.flush()
+    result = await db.execute(
+        _provider_user_id_stmt,
+        {"provider_type": provider_type, "provider_user_id": provider_user_id},
+    )
+    user_id = result.scalar()
+    if user_id is not None:
+        return user_id
 
-        auth_provider = AuthProvider(
-            user_id=user.id,
-            provider_type="apple",
-            provider_user_id=provider_user_id,
-            email=email
-        )
-        db.add(auth_provider)
-        db.commit()
+    # Create new user and auth provider
+    user_id = uuid.uuid4()
+    await db.execute(insert(User).values(id=user_id))
 
-        return user
+    stmt = insert(AuthProvider).values(
+        user_id=user_id,
+        provider_type=provider_type,
+        provider_user_id=provider_user_id,
+        email=email
+    )
+    result = await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[AuthProvider.provider_type,
+                            AuthProvider.provider_user_id],
+            set_={"email": stmt.excluded.email},
+        ).returning(AuthProvider.user_id)
+    )
+    linked_user_id = result.scalar_one()
+
+    if linked_user_id != user_id:
+        # Another request linked this account first
+        await db.rollback()
+        return linked_user_id
+
+    await db.commit()
+    return user_id
+
+
+async def get_or_create_apple_user(user_info, db: AsyncSession) -> uuid.UUID:
+    """
+    Get existing user or create a new one based on Apple user info.
+    Returns the user ID.
+    """
+    return await get_or_create_provider_user_id(
+        db, "apple", user_info["provider_user_id"], user_info.get("email"))
 
 
 @router.post("/mock-apple-signin", response_model=AuthResponse)
-async def mock_apple_signin(db: Session = Depends(get_db)):
+async def mock_apple_signin(db: AsyncSession = Depends(get_db)):
     """
     Mock Apple Sign-In for local development
     """
@@ -192,50 +338,25 @@ async def mock_apple_signin(db: Session = Depends(get_db)):
     provider_user_id = "mock-apple-user-id"
     email = "mock-user@example.com"
 
-    # Check if this provider account exists
-    auth_provider = db.query(AuthProvider).filter(
-        AuthProvider.provider_type == "apple",
-        AuthProvider.provider_user_id == provider_user_id
-    ).first()
-
-    if auth_provider:
-        # User exists, return token
-        user = auth_provider.user
-    else:
-        # Create new user and auth provider
-        user = User()
-        db.add(user)
-        db.flush()
-
-        auth_provider = AuthProvider(
-            user_id=user.id,
-            provider_type="apple",
-            provider_user_id=provider_user_id,
-            email=email
-        )
-        db.add(auth_provider)
-        db.commit()
+    user_id = await get_or_create_provider_user_id(
+        db, "apple", provider_user_id, email)
 
     # Generate JWT token
-    token = create_access_token(data={"sub": str(user.id)})
+    token = create_access_token(data={"sub": str(user_id)})
 
-    return {"access_token": token, "token_type": "bearer", "user_id": str(user.id)}
+    return {"access_token": token, "token_type": "bearer", "user_id": str(user_id)}
 
 
 @router.post("/signin", response_model=AuthResponse)
-async def signin(auth_request: AuthRequest, db: Session = Depends(get_db)):
+async def signin(auth_request: AuthRequest, db: AsyncSession = Depends(get_db)):
     """
     Sign in or sign up a user with a third-party provider
     """
-    # Verify the token
-    user_info = None
+    # Verify the token (AuthRequest only admits google and apple)
     if auth_request.provider_type == "google":
         user_info = await verify_google_token(auth_request.id_token)
-    elif auth_request.provider_type == "apple":
-        user_info = await verify_apple_token(auth_request.id_token)
     else:
-        raise HTTPException(
-            status_code=400, detail="Unsupported provider type")
+        user_info = await verify_apple_token(auth_request.id_token)
 
     if not user_info:
         raise HTTPException(
@@ -245,54 +366,29 @@ async def signin(auth_request: AuthRequest, db: Session = Depends(get_db)):
     provider_user_id = user_info["provider_user_id"]
     email = user_info.get("email")
 
-    # Check if this provider account exists
-    auth_provider = db.query(AuthProvider).filter(
-        AuthProvider.provider_type == auth_request.provider_type,
-        AuthProvider.provider_user_id == provider_user_id
-    ).first()
-
-    if auth_provider:
-        # User exists, return token
-        user = auth_provider.user
-    else:
-        # Create new user and auth provider
-        user = User()
-        db.add(user)
-        db.flush()
-
-        auth_provider = AuthProvider(
-            user_id=user.id,
-            provider_type=auth_request.provider_type,
-            provider_user_id=provider_user_id,
-            email=email
-        )
-        db.add(auth_provider)
-        db.commit()
+    user_id = await get_or_create_provider_user_id(
+        db, auth_request.provider_type, provider_user_id, email)
 
     # Generate JWT token
-    token = create_access_token(data={"sub": str(user.id)})
+    token = create_access_token(data={"sub": str(user_id)})
 
-    return {"access_token": token, "token_type": "bearer", "user_id": str(user.id)}
+    return {"access_token": token, "token_type": "bearer", "user_id": str(user_id)}
 
 
 @router.post("/link-account", response_model=AuthResponse)
 async def link_account(
     auth_request: AuthRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
     Link a new provider account to an existing user
     """
-    # Verify the token
-    user_info = None
+    # Verify the token (AuthRequest only admits google and apple)
     if auth_request.provider_type == "google":
         user_info = await verify_google_token(auth_request.id_token)
-    elif auth_request.provider_type == "apple":
-        user_info = await verify_apple_token(auth_request.id_token)
     else:
-        raise HTTPException(
-            status_code=400, detail="Unsupported provider type")
+        user_info = await verify_apple_token(auth_request.id_token)
 
     if not user_info:
         raise HTTPException(
@@ -303,33 +399,32 @@ async def link_account(
     email = user_info.get("email")
 
     # Check if this provider account already exists
-    existing_provider = db.query(AuthProvider).filter(
-        AuthProvider.provider_type == auth_request.provider_type,
-        AuthProvider.provider_user_id == provider_user_id
-    ).first()
+    result = await db.execute(
+        select(AuthProvider).where(
+            AuthProvider.provider_type == auth_request.provider_type,
+            AuthProvider.provider_user_id == provider_user_id
+        )
+    )
+    existing_provider = result.scalars().first()
 
     if existing_provider:
         if existing_provider.user_id != current_user.id:
             raise HTTPException(
                 status_code=400, detail="This account is already linked to another user")
-        return {
-            "access_token": create_access_token(data={"sub": str(current_user.id)}),
-            "token_type": "bearer",
-            "user_id": str(current_user.id)
-        }
-
-    # Create new auth provider for current user
-    auth_provider = AuthProvider(
-        user_id=current_user.id,
-        provider_type=auth_request.provider_type,
-        provider_user_id=provider_user_id,
-        email=email
-    )
-    db.add(auth_provider)
-    db.commit()
+    else:
+        # Create new auth provider for current user
+        auth_provider = AuthProvider(
+            user_id=current_user.id,
+            provider_type=auth_request.provider_type,
+            provider_user_id=provider_user_id,
+            email=email
+        )
+        db.add(auth_provider)
+        await db.commit()
 
+    user_id = str(current_user.id)
     return {
-        "access_token": create_access_token(data={"sub": str(current_user.id)}),
+        "access_token": create_access_token(data={"sub": user_id}),
         "token_type": "bearer",
-        "user_id": str(current_user.id)
+        "user_id": user_id
     }
@@ -1,52 +1,114 @@
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, status, Query
-from sqlalchemy.orm import Session
-from typing import List, Optional
+import logging
+from contextlib import aclosing
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Tuple
 import uuid
 
-from app.db.session import get_db
-from app.schemas.message import MessageCreate, MessageResponse
-from app.schemas.conversation import ConversationCreate, ConversationResponse, ConversationList
+from app.core.websocket import receive_json, send_json
+from app.db.session import SessionLocal, get_db
+from app.schemas.message import MESSAGE_LIST_ADAPTER, MessageCreate, MessageResponse
+from app.schemas.conversation import CONVERSATION_LIST_ADAPTER, ConversationCreate, ConversationResponse
 from app.services.chat_service import ChatService
 from app.api.dependencies import get_chat_service
-from app.api.auth import get_current_user
-from app.api.permissions import verify_conversation_owner, verify_message_access, get_current_user_or_raise
+from app.api.auth import get_current_user_id_ws
+from app.api.permissions import verify_conversation_owner, verify_message_access, get_current_user_or_raise, owns_conversation
 from app.models.user import User
 from app.models.conversation import Conversation
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
+# Largest page a listing returns
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(timestamp: datetime, row_id: uuid.UUID) -> str:
+    """
+    Build the keyset cursor of a row: its timestamp and, to break ties
+    between rows with the same timestamp, its id.
+    """
+    return f"{timestamp.isoformat().replace('+00:00', 'Z')}_{row_id}"
+
+
+def decode_cursor(cursor: Optional[str]) -> Tuple[Optional[datetime], Optional[uuid.UUID]]:
+    """
+    Split a cursor made by encode_cursor into its timestamp and id. A bare
+    timestamp, as sent by older clients, is accepted without an id.
+    """
+    if cursor is None:
+        return None, None
+    timestamp, _, row_id = cursor.partition("_")
+    # fromisoformat only accepts a Z suffix from Python 3.11 on
+    if timestamp.endswith("Z"):
+        timestamp = timestamp[:-1] + "+00:00"
+    try:
+        return datetime.fromisoformat(timestamp), uuid.UUID(row_id) if row_id else None
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+
+def json_list_response(
+    adapter: TypeAdapter, items: list, next_cursor: Optional[str] = None
+) -> Response:
+    """
+    Serialize ORM rows with a prebuilt list adapter, bypassing FastAPI's
+    per-item response_model validation and re-encoding.
+    The cursor of the next page, if any, is sent in the X-Next-Cursor header.
+    """
+    headers = None
+    if next_cursor is not None:
+        headers = {"X-Next-Cursor": next_cursor}
+    return Response(
+        content=adapter.dump_json(adapter.validate_python(items, from_attributes=True)),
+        media_type="application/json",
+        headers=headers,
+    )
+
 
 @router.post("/conversations/", response_model=ConversationResponse, status_code=status.HTTP_201_CREATED)
 async def create_conversation(
     conversation: ConversationCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     chat_service: ChatService = Depends(get_chat_service),
     current_user: User = Depends(get_current_user_or_raise)
 ):
     """
     Create a new conversation for the authenticated user.
     """
-    return chat_service.create_conversation(db, conversation, current_user.id)
+    return await chat_service.create_conversation(db, conversation, current_user.id)
 
 
 @router.get("/conversations/", response_model=List[ConversationResponse])
 async def get_conversations(
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db),
+    before: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
     chat_service: ChatService = Depends(get_chat_service),
     current_user: User = Depends(get_current_user_or_raise)
 ):
     """
-    Get all conversations for the authenticated user with pagination.
+    Get the authenticated user's conversations, most recently updated first.
+    When more remain, X-Next-Cursor holds the before value for the next page.
     """
-    return chat_service.get_user_conversations(db, current_user.id, skip=skip, limit=limit)
+    before, before_id = decode_cursor(before)
+    conversations = await chat_service.get_user_conversations(
+        db, current_user.id, before=before, before_id=before_id, limit=limit)
+    next_cursor = None
+    if len(conversations) == limit:
+        next_cursor = encode_cursor(conversations[-1].updated_at, conversations[-1].id)
+    return json_list_response(CONVERSATION_LIST_ADAPTER, conversations, next_cursor)
 
 
 @router.get("/conversations/{conversation_id}", response_model=ConversationResponse)
 async def get_conversation(
     conversation_id: uuid.UUID,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     chat_service: ChatService = Depends(get_chat_service),
     conversation: Conversation = Depends(verify_conversation_owner)
 ):
@@ -56,20 +118,24 @@ async def get_conversation(
     return conversation
 
 
-@router.post("/conversations/{conversation_id}/messages/", response_model=List[MessageResponse])
+@router.post(
+    "/conversations/{conversation_id}/messages/",
+    response_model=List[MessageResponse],
+    dependencies=[Depends(verify_message_access)],
+)
 async def create_message(
     conversation_id: uuid.UUID,
     message: MessageCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     chat_service: ChatService = Depends(get_chat_service),
-    conversation: Conversation = Depends(verify_conversation_owner)
 ):
     """
     Create a new message in a conversation and get AI responses.
     Only the conversation owner can create messages.
     """
     try:
-        return await chat_service.process_message(db, conversation_id, message)
+        messages = await chat_service.process_message(db, conversation_id, message)
+        return json_list_response(MESSAGE_LIST_ADAPTER, messages)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
@@ -77,29 +143,68 @@ async def create_message(
             status_code=500, detail=f"An error occurred: {str(e)}")
 
 
-@router.get("/conversations/{conversation_id}/messages/", response_model=List[MessageResponse])
+@router.post(
+    "/conversations/{conversation_id}/messages/stream",
+    dependencies=[Depends(verify_message_access)],
+)
+async def stream_message(
+    conversation_id: uuid.UUID,
+    message: MessageCreate,
+    chat_service: ChatService = Depends(get_chat_service),
+):
+    """
+    Create a new message in a conversation and stream the AI responses as
+    server-sent events, one MessageResponse per event, ending with [DONE].
+    Only the conversation owner can create messages.
+    """
+    async def events():
+        # The request's session is closed once the route returns, before
+        # the body is sent, so the stream opens its own. The messages are
+        # closed with the response, so a disconnect saves what was sent
+        async with SessionLocal() as db, aclosing(
+            chat_service.iter_messages(db, conversation_id, message)
+        ) as db_messages:
+            async for db_message in db_messages:
+                payload = MessageResponse.model_validate(db_message).model_dump_json()
+                yield f"data: {payload}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@router.get(
+    "/conversations/{conversation_id}/messages/",
+    response_model=List[MessageResponse],
+    dependencies=[Depends(verify_message_access)],
+)
 async def get_messages(
     conversation_id: uuid.UUID,
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db),
+    before: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
     chat_service: ChatService = Depends(get_chat_service),
-    conversation: Conversation = Depends(verify_conversation_owner)
 ):
     """
-    Get all messages for a conversation with pagination.
-    Only the conversation owner can access messages.
+    Get the latest messages of a conversation, oldest first.
+    When earlier messages remain, X-Next-Cursor holds the before value for
+    the previous page. Only the conversation owner can access messages.
     """
-    return chat_service.get_messages(db, conversation_id, skip=skip, limit=limit)
+    before, before_id = decode_cursor(before)
+    messages = await chat_service.get_messages(
+        db, conversation_id, before=before, before_id=before_id, limit=limit)
+    next_cursor = None
+    if len(messages) == limit:
+        next_cursor = encode_cursor(messages[0].created_at, messages[0].id)
+    return json_list_response(MESSAGE_LIST_ADAPTER, messages, next_cursor)
 
 
 @router.websocket("/ws/{conversation_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     conversation_id: uuid.UUID,
-    token: str = Query(...),
-    db: Session = Depends(get_db),
-    chat_service: ChatService = Depends(get_chat_service)
+    db: AsyncSession = Depends(get_db),
+    chat_service: ChatService = Depends(get_chat_service),
+    user_id: Optional[uuid.UUID] = Depends(get_current_user_id_ws)
 ):
     """
     WebSocket endpoint for streaming responses.
@@ -109,38 +214,32 @@ async def websocket_endpoint(
 
     # Verify token and get user
     try:
-        from app.api.auth import jwt, settings, TokenPayload
-        payload = jwt.decode(token, settings.SECRET_KEY,
-                             algorithms=[settings.ALGORITHM])
-        user_id = payload.get("sub")
-        if not user_id:
-            await websocket.send_json({"error": "Invalid authentication token"})
-            await websocket.close()
-            return
-
-        # Check if conversation exists and user owns it
-        conversation = chat_service.get_conversation(db, conversation_id)
-        if not conversation:
-            await websocket.send_json({"error": "Conversation not found"})
+        if user_id is None:
+            await send_json(websocket, {"error": "Invalid authentication token"})
             await websocket.close()
             return
 
-        if conversation.user_id != uuid.UUID(user_id):
-            await websocket.send_json({"error": "Not authorized to access this conversation"})
+        # Check that the conversation exists and the user owns it
+        if not await owns_conversation(db, conversation_id, user_id):
+            await send_json(websocket, {"error": "Conversation not found"})
             await websocket.close()
             return
     except Exception as e:
-        await websocket.send_json({"error": f"Authentication error: {str(e)}"})
+        await send_json(websocket, {"error": f"Authentication error: {str(e)}"})
         await websocket.close()
         return
 
     try:
+        # The recent history is kept for the connection; each turn appends
+        # to it instead of reading it back from the database
+        history = await chat_service.get_history_window(db, conversation_id)
+
         while True:
-            data = await websocket.receive_json()
+            data = await receive_json(websocket)
 
             # Validate the received data
             if "content" not in data:
-                await websocket.send_json({"error": "Message content is required"})
+                await send_json(websocket, {"error": "Message content is required"})
                 continue
 
             message = MessageCreate(
@@ -150,12 +249,14 @@ async def websocket_endpoint(
             )
 
             # Process the message and stream AI responses
-            await chat_service.stream_response(websocket, db, conversation_id, message)
+            await chat_service.stream_response(
+                websocket, db, conversation_id, message, history
+            )
     except WebSocketDisconnect:
-        print(f"WebSocket disconnected for conversation {conversation_id}")
+        logger.info("WebSocket disconnected for conversation %s", conversation_id)
     except Exception as e:
-        print(f"Error in WebSocket: {str(e)}")
+        logger.exception("Error in WebSocket")
         try:
-            await websocket.send_json({"error": f"An error occurred: {str(e)}"})
+            await send_json(websocket, {"error": f"An error occurred: {str(e)}"})
         except Exception:
             pass  # Connection might already be closed
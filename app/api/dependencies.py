@@ -1,8 +1,18 @@
+from fastapi import Depends
+
+from app.core.config import Settings, get_settings
 from app.services.chat_service import ChatService
 
+# ChatService only holds configuration set up in __init__, so one instance
+# is shared by all requests, and rebuilt only when the settings change
+_chat_service = None
+
 
-def get_chat_service() -> ChatService:
+def get_chat_service(settings: Settings = Depends(get_settings)) -> ChatService:
     """
-    Dependency to get a ChatService instance.
+    Dependency to get the shared ChatService instance built from the current settings.
     """
-    return ChatService()
+    global _chat_service
+    if _chat_service is None or _chat_service.settings is not settings:
+        _chat_service = ChatService(settings)
+    return _chat_service
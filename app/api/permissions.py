@@ -1,8 +1,10 @@
 from fastapi import HTTPException, status, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy import exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
 import uuid
 
-from app.api.auth import get_current_user
+from app.api.auth import get_current_user, get_current_user_id
 from app.db.session import get_db
 from app.models.user import User
 from app.models.conversation import Conversation
@@ -24,17 +26,52 @@ async def get_current_user_or_raise(
     return current_user
 
 
+async def get_owned_conversation(
+    db: AsyncSession, conversation_id: uuid.UUID, user_id: uuid.UUID
+) -> Optional[Conversation]:
+    """
+    Get a conversation by ID only if it belongs to the given user.
+    Existence and ownership are checked by the same query.
+    """
+    result = await db.execute(
+        select(Conversation).where(
+            Conversation.id == conversation_id,
+            Conversation.user_id == user_id,
+        )
+    )
+    return result.scalars().first()
+
+
+async def owns_conversation(
+    db: AsyncSession, conversation_id: uuid.UUID, user_id: uuid.UUID
+) -> bool:
+    """
+    Check that a conversation exists and belongs to the given user
+    without loading the row.
+    """
+    result = await db.execute(
+        select(
+            exists().where(
+                Conversation.id == conversation_id,
+                Conversation.user_id == user_id,
+            )
+        )
+    )
+    return result.scalar()
+
+
 async def verify_conversation_owner(
     conversation_id: uuid.UUID,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user_or_raise),
+    db: AsyncSession = Depends(get_db),
+    user_id: uuid.UUID = Depends(get_current_user_id),
 ) -> Conversation:
     """
     Verify that the current user owns the conversation.
     Returns the conversation if the user is the owner, otherwise raises an exception.
+    Conversations owned by someone else are reported as not found so that
+    their existence is not leaked.
     """
-    conversation = db.query(Conversation).filter(
-        Conversation.id == conversation_id).first()
+    conversation = await get_owned_conversation(db, conversation_id, user_id)
 
     if not conversation:
         raise HTTPException(
@@ -42,22 +79,21 @@ async def verify_conversation_owner(
             detail="Conversation not found"
         )
 
-    if conversation.user_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not authorized to access this conversation"
-        )
-
     return conversation
 
 
 async def verify_message_access(
     conversation_id: uuid.UUID,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user_or_raise),
-) -> Conversation:
+    db: AsyncSession = Depends(get_db),
+    user_id: uuid.UUID = Depends(get_current_user_id),
+) -> None:
     """
     Verify that the current user has access to messages in the conversation.
-    This is a wrapper around verify_conversation_owner for semantic clarity.
+    Unlike verify_conversation_owner, the conversation itself is not loaded,
+    for routes that only need the access check.
     """
-    return await verify_conversation_owner(conversation_id, db, current_user)
+    if not await owns_conversation(db, conversation_id, user_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Conversation not found"
+        )
@@ -1,7 +1,7 @@
-import os
-from typing import Any, Dict, Optional
+from functools import cached_property, lru_cache
+from typing import Optional
 
-from pydantic import PostgresDsn, field_validator
+from pydantic import PostgresDsn, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -11,6 +11,7 @@ class Settings(BaseSettings):
     # API settings
     API_HOST: str = "0.0.0.0"
     API_PORT: int = 8000
+    LOG_LEVEL: str = "INFO"
 
     # Database settings
     POSTGRES_USER: str
@@ -18,44 +19,66 @@ class Settings(BaseSettings):
     POSTGRES_DB: str
     POSTGRES_HOST: str
     POSTGRES_PORT: str
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30  # seconds to wait for a free connection
+    DB_POOL_RECYCLE: int = 1800  # seconds before a connection is replaced
+    SLOW_QUERY_THRESHOLD_MS: int = 100  # queries slower than this are logged
 
     # OpenRouter API settings
     OPENROUTER_API_KEY: str
     OPENROUTER_API_ENDPOINT: str = "https://openrouter.ai/api/v1/chat/completions"
     OPENROUTER_MODEL_NAME: str = "anthropic/claude-3.7-sonnet"
+    TRANSLATION_MODEL: str = "anthropic/claude-3-haiku"
+    TRANSLATION_MAX_TOKENS: int = 2000  # upper bound of a translation's length
+    TRANSLATION_BATCH_MAX_TOKENS: int = 4096  # upper bound of a batched translation's length
+    COMPLETION_REQUEST_TIMEOUT: float = 4.0  # seconds before a short completion is retried
+    COMPLETION_MAX_RETRIES: int = 1
+    STREAM_READ_TIMEOUT: float = 60.0  # seconds a streamed completion may go without data
+    ANALYSIS_CACHE_TTL: int = 600  # seconds an analysis is reused for a repeated message
+    CIRCUIT_BREAKER_FAILURES: int = 5  # consecutive failures before calls are skipped
+    CIRCUIT_BREAKER_RESET_TIMEOUT: float = 30.0  # seconds calls are skipped for
 
     # JWT Authentication settings
-    SECRET_KEY: str = os.getenv(
-        "SECRET_KEY", "your-secret-key-for-development")
+    SECRET_KEY: str = "your-secret-key-for-development"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7  # 7 days
+    AUTH_CACHE_TTL: int = 30  # seconds a verified token is trusted without re-decoding
 
     # OAuth settings
-    GOOGLE_CLIENT_ID: str = os.getenv("GOOGLE_CLIENT_ID", "")
-    APPLE_CLIENT_ID: str = os.getenv("APPLE_CLIENT_ID", "com.teja.sai.service")
-    # Your Apple Developer Team ID
-    APPLE_TEAM_ID: str = os.getenv("APPLE_TEAM_ID", "")
-    APPLE_KEY_ID: str = os.getenv("APPLE_KEY_ID", "")    # Your private key ID
-    APPLE_PRIVATE_KEY_PATH: str = os.getenv(
-        "APPLE_PRIVATE_KEY_PATH", "/app/private_key.p8"
-    )
+    GOOGLE_CLIENT_ID: str = ""
+    APPLE_CLIENT_ID: str = "com.teja.sai.service"
+    APPLE_TEAM_ID: str = ""  # Your Apple Developer Team ID
+    APPLE_KEY_ID: str = ""  # Your private key ID
+    APPLE_PRIVATE_KEY_PATH: str = "/app/private_key.p8"
 
     # Computed settings
     DATABASE_URI: Optional[PostgresDsn] = None
 
-    @field_validator("DATABASE_URI", mode="before")
-    def assemble_db_connection(cls, v: Optional[str], values: Dict[str, Any]) -> Any:
-        if isinstance(v, str):
-            return v
+    @model_validator(mode="after")
+    def assemble_db_connection(self) -> "Settings":
+        if self.DATABASE_URI is None:
+            self.DATABASE_URI = PostgresDsn.build(
+                scheme="postgresql",
+                username=self.POSTGRES_USER,
+                password=self.POSTGRES_PASSWORD,
+                host=self.POSTGRES_HOST,
+                port=int(self.POSTGRES_PORT),
+                path=self.POSTGRES_DB,
+            )
+        return self
 
-        return PostgresDsn.build(
-            scheme="postgresql",
-            username=values.data.get("POSTGRES_USER"),
-            password=values.data.get("POSTGRES_PASSWORD"),
-            host=values.data.get("POSTGRES_HOST"),
-            port=int(values.data.get("POSTGRES_PORT")),
-            path=f"{values.data.get('POSTGRES_DB') or ''}",
-        )
+    @cached_property
+    def DATABASE_URI_STR(self) -> str:
+        return str(self.DATABASE_URI)
 
 
-settings = Settings()
+@lru_cache
+def get_settings() -> Settings:
+    """
+    Get the application settings, read from the environment once.
+    """
+    return Settings()
+
+
+settings = get_settings()
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, TypeVar
+
+import httpx
+import orjson
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Sent with request bodies serialized by orjson, which httpx cannot label
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Shared HTTP client so outbound calls reuse pooled keep-alive connections
+# instead of paying a TCP + TLS handshake per request
+http_client = httpx.AsyncClient(
+    timeout=10.0,
+    limits=httpx.Limits(max_keepalive_connections=20),
+)
+
+# Client for OpenRouter model calls. HTTP/2 lets concurrent chats share a
+# connection, and reads are unbounded by default; callers set a read
+# timeout on each request, STREAM_TIMEOUT for streamed ones.
+openrouter_client = httpx.AsyncClient(
+    http2=True,
+    timeout=httpx.Timeout(30.0, connect=5.0, read=None),
+    limits=httpx.Limits(
+        max_connections=200, max_keepalive_connections=100, keepalive_expiry=30.0
+    ),
+    headers={"Authorization": f"Bearer {settings.OPENROUTER_API_KEY}"},
+)
+
+# Timeout of a streamed completion. A long generation is fine as long as
+# data keeps arriving; an upstream that stalls is given up on.
+STREAM_TIMEOUT = httpx.Timeout(30.0, connect=5.0, read=settings.STREAM_READ_TIMEOUT)
+
+
+# Response statuses worth retrying: rate limiting and server errors
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+@dataclass(frozen=True)
+class CompletionConfig:
+    """
+    Timeout and retry budget for short, non-streaming completions. With a
+    total_timeout, all attempts and the waits between them share that
+    deadline.
+    """
+
+    request_timeout: float = settings.COMPLETION_REQUEST_TIMEOUT
+    max_retries: int = settings.COMPLETION_MAX_RETRIES
+    total_timeout: Optional[float] = None
+
+
+async def call_with_retry(
+    call: Callable[[], Awaitable[T]], config: CompletionConfig, description: str
+) -> T:
+    """
+    Await call() with a timeout just above the usual latency, retrying with
+    exponential backoff, so a stuck request is replaced instead of waited
+    out. Only timeouts, transport errors and the errors raised for
+    retryable response statuses are retried, and only while the total
+    timeout, if any, leaves time for another attempt.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = None
+    if config.total_timeout is not None:
+        deadline = loop.time() + config.total_timeout
+
+    for attempt in range(config.max_retries + 1):
+        timeout = config.request_timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - loop.time())
+        try:
+            return await asyncio.wait_for(call(), timeout=timeout)
+        except (asyncio.TimeoutError, httpx.HTTPError) as e:
+            if attempt == config.max_retries or not is_retryable(e):
+                raise
+            # Jittered, so requests that failed together do not retry together
+            backoff = 0.25 * 2 ** attempt * random.uniform(0.5, 1.5)
+            if deadline is not None and loop.time() + backoff >= deadline:
+                raise
+            logger.warning("%s failed, retrying", description, exc_info=True)
+            await asyncio.sleep(backoff)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a request that failed with error may succeed when repeated"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (asyncio.TimeoutError, httpx.HTTPError))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a call while its circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing upstream. After a run of consecutive failures
+    the circuit opens, and callers skip their calls until the reset timeout
+    has passed. Calls are then let through again; the first failure opens
+    the circuit again, and a success closes it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = settings.CIRCUIT_BREAKER_FAILURES,
+        reset_timeout: float = settings.CIRCUIT_BREAKER_RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        return (
+            self._opened_at is not None
+            and time.monotonic() - self._opened_at < self.reset_timeout
+        )
+
+    def record_success(self) -> None:
+        if self._opened_at is not None:
+            logger.info("%s circuit closed", self.name)
+        self._failures = 0
+        self._opened_at = None
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._failures >= self.failure_threshold:
+            if not self.is_open:
+                logger.warning(
+                    "%s circuit opened after %s failures", self.name, self._failures
+                )
+            self._opened_at = time.monotonic()
+
+
+async def post_with_retry(
+    client: httpx.AsyncClient, url: str, config: CompletionConfig, **kwargs
+) -> httpx.Response:
+    """
+    POST through call_with_retry. Responses of any status are returned to
+    the caller.
+    """
+    return await call_with_retry(
+        lambda: client.post(url, **kwargs), config, f"Request to {url}"
+    )
+
+
+async def iter_sse_data(response: httpx.Response) -> AsyncIterator[bytes]:
+    """
+    Yield the payload of each data line of a server-sent events response.
+    Lines are cut out of a byte buffer, so nothing is decoded to str and
+    only complete lines are copied.
+    """
+    buffer = bytearray()
+    async for chunk in response.aiter_bytes(4096):
+        buffer += chunk
+        start = 0
+        while (end := buffer.find(b"\n", start)) != -1:
+            if buffer.startswith(b"data: ", start, end):
+                yield bytes(buffer[start + 6:end]).rstrip(b"\r")
+            start = end + 1
+        del buffer[:start]
+    if buffer.startswith(b"data: "):
+        yield bytes(buffer[6:]).rstrip(b"\r")
+
+
+async def iter_completion_content(
+    response: httpx.Response, finish_reasons: Optional[List[str]] = None
+) -> AsyncIterator[str]:
+    """
+    Yield the content of each chunk of a streamed chat completion, up to
+    the [DONE] event. Events that are not JSON, or carry no content, are
+    skipped. The finish reasons the stream reports are appended to
+    finish_reasons, if given.
+    """
+    async for data in iter_sse_data(response):
+        if data == b"[DONE]":
+            break
+
+        try:
+            parsed = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            logger.debug("Error parsing JSON: %s", data)
+            continue
+
+        choices = parsed.get("choices")
+        if not choices:
+            continue
+        if finish_reasons is not None and choices[0].get("finish_reason"):
+            finish_reasons.append(choices[0]["finish_reason"])
+        content = choices[0].get("delta", {}).get("content")
+        if content:
+            yield content
+
+
+async def close_http_client() -> None:
+    """Close the shared HTTP clients and their pooled connections."""
+    await http_client.aclose()
+    await openrouter_client.aclose()
@@ -0,0 +1,46 @@
+import logging
+import logging.handlers
+import queue
+import sys
+from typing import Optional
+
+from app.core.config import settings
+
+# Handlers do their blocking I/O on the listener's thread, so logging from a
+# request handler only costs a queue put
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging() -> None:
+    """
+    Route application logging through a queue drained by a background listener.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(-1)
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(settings.LOG_LEVEL)
+    app_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    app_logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, stream_handler, respect_handler_level=True
+    )
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """
+    Flush pending records and stop the background listener.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,25 @@
+from typing import Any
+
+import orjson
+from fastapi import WebSocket, WebSocketDisconnect
+
+
+async def receive_json(websocket: WebSocket) -> Any:
+    """
+    Receive a JSON message from a text or binary frame, decoded with orjson.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+
+    data = message.get("text")
+    if data is None:
+        data = message.get("bytes")
+    return orjson.loads(data)
+
+
+async def send_json(websocket: WebSocket, data: Any) -> None:
+    """
+    Send data as a JSON text frame, encoded with orjson.
+    """
+    await websocket.send_text(orjson.dumps(data).decode())
@@ -1,13 +1,36 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api import api_router
-from app.core.config import settings
+from app.core.http import close_http_client
+from app.core.logging_config import setup_logging, shutdown_logging
+from app.db.session import engine, warm_up_pool
+from app.services.auth import refresh_jwks_periodically
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Manage resources that live for the whole lifetime of the application.
+    """
+    setup_logging()
+    await warm_up_pool()
+    jwks_refresher = asyncio.create_task(refresh_jwks_periodically())
+    yield
+    jwks_refresher.cancel()
+    await close_http_client()
+    await engine.dispose()
+    shutdown_logging()
+
 
 app = FastAPI(
     title="Sway Chat API",
     description="Backend API for Sway chat application",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # Set up CORS middleware
@@ -17,6 +40,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all methods
     allow_headers=["*"],  # Allow all headers
+    # Let browser clients read the pagination cursor
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include API router
@@ -1,8 +1,7 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey
+from sqlalchemy import Column, String, DateTime, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
-import uuid
-from datetime import datetime
+from sqlalchemy.sql import func
 
 from app.db.base import Base
 
@@ -10,14 +9,22 @@ from app.db.base import Base
 class Conversation(Base):
     __tablename__ = "conversations"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True,
+                server_default=func.gen_random_uuid())
     name = Column(String, nullable=True)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow,
-                        onupdate=datetime.utcnow)
+    user_id = Column(UUID(as_uuid=True), ForeignKey(
+        "users.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True),
+                        server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(),
+                        onupdate=func.now(), nullable=False)
+
+    # Serves the per-user listing, most recently updated first
+    __table_args__ = (
+        Index("ix_conversations_user_updated", user_id, updated_at, id),
+    )
 
     # Relationships
-    user = relationship("User", back_populates="conversations")
+    user = relationship("User", back_populates="conversations", lazy="raise")
     messages = relationship(
         "Message", back_populates="conversation", cascade="all, delete-orphan")
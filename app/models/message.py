@@ -1,8 +1,7 @@
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Index, Text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
-import uuid
-from datetime import datetime
+from sqlalchemy.sql import func
 
 from app.db.base import Base
 
@@ -10,12 +9,22 @@ from app.db.base import Base
 class Message(Base):
     __tablename__ = "messages"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True,
+                server_default=func.gen_random_uuid())
     conversation_id = Column(
         UUID(as_uuid=True), ForeignKey("conversations.id"))
     content = Column(Text, nullable=False)
     sender_id = Column(String, nullable=True)  # Device ID or session ID
     is_user = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True),
+                        server_default=func.now(), nullable=False)
 
-    conversation = relationship("Conversation", back_populates="messages")
+    # Serves the latest-messages-first history window
+    __table_args__ = (
+        Index(
+            "ix_messages_conv_created", conversation_id, created_at.desc(), id.desc()
+        ),
+    )
+
+    conversation = relationship(
+        "Conversation", back_populates="messages", lazy="raise")
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, EmailStr, validator
+from pydantic import BaseModel, Field, EmailStr, field_validator
 from typing import Optional, Literal
 from uuid import UUID
 
@@ -9,9 +9,11 @@ class AuthRequest(BaseModel):
     email: Optional[EmailStr] = None
     id_token: str = Field(..., min_length=10)
 
-    @validator("id_token")
+    @field_validator("id_token")
+    @classmethod
     def validate_id_token(cls, v):
-        if not v or len(v.strip()) < 10:
+        # min_length already holds; reject tokens padded out with whitespace
+        if len(v.strip()) < 10:
             raise ValueError("ID token must be a valid token string")
         return v
 
@@ -2,14 +2,15 @@ from datetime import datetime
 from typing import List, Optional
 import uuid
 
-from pydantic import BaseModel, ConfigDict, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, field_validator
 
 
 # Shared properties
 class ConversationBase(BaseModel):
     name: Optional[str] = Field(None, max_length=100)
 
-    @validator("name")
+    @field_validator("name")
+    @classmethod
     def validate_name(cls, v):
         if v is not None and v.strip() == "":
             return None
@@ -33,3 +34,7 @@ class ConversationResponse(ConversationBase):
 # Properties for conversation list
 class ConversationList(BaseModel):
     conversations: List[ConversationResponse]
+
+
+# Validates ORM rows and dumps them to JSON in one pass for list responses
+CONVERSATION_LIST_ADAPTER = TypeAdapter(List[ConversationResponse])
@@ -2,7 +2,7 @@ from datetime import datetime
 from typing import List, Optional
 import uuid
 
-from pydantic import BaseModel, ConfigDict, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, field_validator
 
 
 # Shared properties
@@ -11,9 +11,11 @@ class MessageBase(BaseModel):
     is_user: bool = True
     sender_id: Optional[str] = Field(None, max_length=255)
 
-    @validator("content")
+    @field_validator("content")
+    @classmethod
     def validate_content(cls, v):
-        if not v or v.strip() == "":
+        # min_length already holds; reject whitespace-only content
+        if not v.strip():
             raise ValueError("Message content cannot be empty")
         return v
 
@@ -35,3 +37,7 @@ class MessageResponse(MessageBase):
 # Properties for message list
 class MessageList(BaseModel):
     messages: List[MessageResponse]
+
+
+# Validates ORM rows and dumps them to JSON in one pass for list responses
+MESSAGE_LIST_ADAPTER = TypeAdapter(List[MessageResponse])
@@ -1,5 +1,7 @@
+from app.services.analysis_batcher import AnalysisBatcher
 from app.services.chat_service import ChatService
 from app.services.conversation_analyzer import ConversationAnalyzer
 from app.services.response_processor import ResponseProcessor
 from app.services.therapy_prompt import TherapyPrompt
+from app.services.translation_batcher import TranslationBatcher
 from app.services.translation_service import TranslationService
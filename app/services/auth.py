@@ -1,8 +1,33 @@
-import requests
-from jose import jwt
+import asyncio
+import logging
+import re
+import time
+from jose import jwk, jwt
 from datetime import datetime, timedelta
 from typing import Optional
 from app.core.config import settings
+from app.core.http import http_client
+
+logger = logging.getLogger(__name__)
+
+# Public signing keys of the identity providers, published as JWK sets
+JWKS_URLS = {
+    "google": "https://www.googleapis.com/oauth2/v3/certs",
+    "apple": "https://appleid.apple.com/auth/keys",
+}
+# Used when a provider does not send Cache-Control: max-age
+JWKS_REFRESH_INTERVAL = 3600  # seconds
+# Minimum delay between refreshes triggered by an unknown key ID, so tokens
+# with made-up key IDs cannot make us hammer the providers
+JWKS_MIN_REFRESH_INTERVAL = 60  # seconds
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+# Constructed keys per provider, indexed by key ID
+_jwks_cache = {
+    provider: {"keys": {}, "fetched_at": 0.0, "expires_at": 0.0}
+    for provider in JWKS_URLS
+}
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -20,6 +45,72 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
+async def refresh_jwks(provider: str) -> None:
+    """
+    Fetch the JWK set of a provider and cache the constructed keys by key ID
+    """
+    response = await http_client.get(JWKS_URLS[provider])
+    response.raise_for_status()
+
+    keys = {
+        k["kid"]: jwk.construct(k, algorithm="RS256")
+        for k in response.json()["keys"]
+    }
+
+    # Keep the keys for as long as the provider says they may be cached
+    match = _MAX_AGE_RE.search(response.headers.get("cache-control", ""))
+    max_age = int(match.group(1)) if match else JWKS_REFRESH_INTERVAL
+
+    now = time.monotonic()
+    _jwks_cache[provider] = {
+        "keys": keys,
+        "fetched_at": now,
+        "expires_at": now + max_age,
+    }
+
+
+async def refresh_jwks_periodically():
+    """
+    Keep the cached JWK sets fresh so token verification never has to wait
+    on a provider's key endpoint
+    """
+    while True:
+        for provider, entry in _jwks_cache.items():
+            if time.monotonic() < entry["expires_at"]:
+                continue
+            try:
+                await refresh_jwks(provider)
+            except Exception:
+                logger.exception("JWKS refresh error for %s", provider)
+
+        # Wake up when the first cached set expires, but retry failed
+        # fetches no sooner than the minimum refresh interval
+        next_expiry = min(entry["expires_at"] for entry in _jwks_cache.values())
+        await asyncio.sleep(
+            max(next_expiry - time.monotonic(), JWKS_MIN_REFRESH_INTERVAL)
+        )
+
+
+async def _get_signing_key(provider: str, key_id: Optional[str]):
+    """
+    Get the cached signing key of a provider by key ID
+    """
+    if not key_id:
+        return None
+
+    entry = _jwks_cache[provider]
+    now = time.monotonic()
+    if now > entry["expires_at"] or (
+        key_id not in entry["keys"]
+        and now - entry["fetched_at"] > JWKS_MIN_REFRESH_INTERVAL
+    ):
+        # The keys are stale, or the provider rotated in a key we have not seen
+        await refresh_jwks(provider)
+        entry = _jwks_cache[provider]
+
+    return entry["keys"].get(key_id)
+
+
 async def verify_google_token(id_token: str):
     """
     Verify Google ID token
@@ -27,20 +118,16 @@ async def verify_google_token(id_token: str):
     In production, you should use the google-auth library for more robust verification
     """
     try:
-        # Google's public keys endpoint
-        google_certs_url = "https://www.googleapis.com/oauth2/v1/certs"
-        response = requests.get(google_certs_url)
-        certs = response.json()
-
-        # Decode and verify the token
+        # Find the matching key
         header = jwt.get_unverified_header(id_token)
-        key_id = header.get("kid")
-        if not key_id or key_id not in certs:
+        key = await _get_signing_key("google", header.get("kid"))
+        if not key:
             return None
 
+        # Decode and verify the token
         payload = jwt.decode(
             id_token,
-            certs[key_id],
+            key,
             algorithms=["RS256"],
             audience=settings.GOOGLE_CLIENT_ID,
         )
@@ -49,8 +136,8 @@ async def verify_google_token(id_token: str):
             "provider_user_id": payload["sub"],
             "email": payload.get("email"),
         }
-    except Exception as e:
-        print(f"Google token verification error: {e}")
+    except Exception:
+        logger.exception("Google token verification error")
         return None
 
 
@@ -59,25 +146,13 @@ async def verify_apple_token(id_token: str):
     Verify Apple ID token
     """
     try:
-        # Apple's public keys endpoint
-        apple_keys_url = "https://appleid.apple.com/auth/keys"
-        response = requests.get(apple_keys_url)
-        keys = response.json()
-
-        # Decode and verify the token
-        header = jwt.get_unverified_header(id_token)
-        key_id = header.get("kid")
-
         # Find the matching key
-        key = None
-        for k in keys["keys"]:
-            if k["kid"] == key_id:
-                key = k
-                break
-
+        header = jwt.get_unverified_header(id_token)
+        key = await _get_signing_key("apple", header.get("kid"))
         if not key:
             return None
 
+        # Decode and verify the token
         payload = jwt.decode(
             id_token,
             key,
@@ -89,6 +164,6 @@ async def verify_apple_token(id_token: str):
             "provider_user_id": payload["sub"],
             "email": payload.get("email"),
         }
-    except Exception as e:
-        print(f"Apple token verification error: {e}")
+    except Exception:
+        logger.exception("Apple token verification error")
         return None
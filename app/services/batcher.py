@@ -0,0 +1,72 @@
+import asyncio
+from typing import Any, Dict, Hashable, List, Tuple
+
+
+class Batcher:
+    """
+    Coalesces items submitted under the same key within a short window into
+    one batch, so concurrent callers share a single request. Each caller
+    still gets its own result back. Subclasses set the batch limits and
+    implement _process.
+    """
+
+    # Most items in one batch
+    max_batch: int = 16
+    # Seconds the first item of a batch waits for others to join it
+    batch_window: float = 0.02
+
+    def __init__(self):
+        self._pending: Dict[Hashable, List[Tuple[Any, asyncio.Future]]] = {}
+        self._flush_handles: Dict[Hashable, asyncio.TimerHandle] = {}
+        # Strong references to running batches, which the loop only keeps weakly
+        self._tasks = set()
+
+    async def _submit(self, key: Hashable, item: Any) -> Any:
+        """Queue an item in the batch of its key and wait for its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((item, future))
+
+        if len(pending) >= self.max_batch:
+            self._flush(key)
+        elif key not in self._flush_handles:
+            self._flush_handles[key] = loop.call_later(self.batch_window, self._flush, key)
+
+        return await future
+
+    def _flush(self, key: Hashable) -> None:
+        flush_handle = self._flush_handles.pop(key, None)
+        if flush_handle is not None:
+            flush_handle.cancel()
+        batch = self._pending.pop(key, None)
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._run(key, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Hashable, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        try:
+            results = await self._process(key, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _process(self, key: Hashable, items: List[Any]) -> List[Any]:
+        """
+        Process one batch, returning a result or an exception for each item,
+        in order
+        """
+        raise NotImplementedError
@@ -1,294 +1,471 @@
-import httpx
-import json
+import asyncio
+import logging
+from collections import deque
+from contextlib import aclosing
+from itertools import islice
+
+import orjson
+from datetime import datetime, timedelta, timezone
 from fastapi import WebSocket
-from sqlalchemy.orm import Session
-from typing import List, Optional, Dict, Any
+from sqlalchemy import exists, select, tuple_
+from sqlalchemy.orm import load_only, raiseload
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import AsyncIterator, Deque, List, Optional, Sequence, Dict, Any, Union
 import uuid
 
-from app.core.config import settings
+from app.core.config import Settings, get_settings
+from app.core.http import (
+    JSON_HEADERS,
+    STREAM_TIMEOUT,
+    iter_completion_content,
+    openrouter_client,
+)
+from app.core.websocket import send_json
+from app.db.session import SessionLocal
 from app.models.conversation import Conversation
 from app.models.message import Message
 from app.schemas.conversation import ConversationCreate
-from app.schemas.message import MessageCreate, MessageResponse
+from app.schemas.message import MessageCreate
 from app.services.conversation_analyzer import ConversationAnalyzer
 from app.services.response_processor import ResponseProcessor
-from app.services.therapy_prompt import TherapyPrompt
+from app.services.therapy_prompt import (
+    get_analyzed_prompt_blocks,
+    get_concise_prompt_blocks,
+    get_fused_prompt_blocks,
+)
 from app.services.translation_service import TranslationService
 
+logger = logging.getLogger(__name__)
 
-class ChatService:
-    def __init__(self):
-        self.api_key = settings.OPENROUTER_API_KEY
-        self.api_endpoint = settings.OPENROUTER_API_ENDPOINT
-        self.model_name = settings.OPENROUTER_MODEL_NAME
+# Streamed tokens are sent to the client in chunks of at least this many
+# characters, or at the end of a sentence
+STREAM_CHUNK_MIN_CHARS = 32
 
-        # Initialize supporting services
-        self.conversation_analyzer = ConversationAnalyzer(api_key=self.api_key)
-        self.response_processor = ResponseProcessor(api_key=self.api_key)
-        self.translation_service = TranslationService(api_key=self.api_key)
+# Number of recent messages sent to the model as context
+HISTORY_WINDOW = 10
+
+# Columns needed to build a ConversationResponse; listings skip the rest
+CONVERSATION_LIST_COLUMNS = (
+    Conversation.id, Conversation.name, Conversation.created_at, Conversation.updated_at
+)
 
-        print(f"ChatService: Initialized with API key: {self.api_key[:5]}...")
-        print(f"ChatService: Using endpoint: {self.api_endpoint}")
-        print(f"ChatService: Using model: {self.model_name}")
 
-    def create_conversation(
-        self, db: Session, conversation: ConversationCreate, user_id: uuid.UUID = None
+class ChatService:
+    def __init__(self, settings: Settings = None):
+        self.settings = settings or get_settings()
+        self.api_key = self.settings.OPENROUTER_API_KEY
+        self.api_endpoint = self.settings.OPENROUTER_API_ENDPOINT
+        self.model_name = self.settings.OPENROUTER_MODEL_NAME
+        # The client already carries the Authorization header; only the
+        # messages change between requests
+        self._client = openrouter_client
+        self._base_payload = {"model": self.model_name}
+        self._stream_payload = {"model": self.model_name, "stream": True}
+        # Analysis and splitting instructions for the single-request path;
+        # the prompt does not depend on the request, so it is built once
+        self._fused_prompt = get_fused_prompt_blocks()
+        self._fused_payload = {
+            **self._stream_payload,
+            "response_format": {"type": "json_object"},
+        }
+
+        # Initialize supporting services
+        self.conversation_analyzer = ConversationAnalyzer(
+            api_key=self.api_key, client=self._client, settings=self.settings)
+        self.response_processor = ResponseProcessor()
+        self.translation_service = TranslationService(
+            api_key=self.api_key, client=self._client, settings=self.settings)
+        # Strong references to running reply saves, which the loop only keeps weakly
+        self._save_tasks = set()
+
+        logger.debug("Initialized with API key: %s...", self.api_key[:5])
+        logger.debug("Using endpoint: %s", self.api_endpoint)
+        logger.debug("Using model: %s", self.model_name)
+
+    async def create_conversation(
+        self, db: AsyncSession, conversation: ConversationCreate, user_id: uuid.UUID = None
     ) -> Conversation:
         """Create a new conversation with optional user association"""
         db_conversation = Conversation(name=conversation.name, user_id=user_id)
         db.add(db_conversation)
-        db.commit()
-        db.refresh(db_conversation)
+        await db.commit()
+        await db.refresh(db_conversation)
         return db_conversation
 
-    def get_conversation(
-        self, db: Session, conversation_id: uuid.UUID
+    async def get_conversation(
+        self, db: AsyncSession, conversation_id: uuid.UUID
     ) -> Optional[Conversation]:
         """Get a conversation by ID"""
-        return db.query(Conversation).filter(Conversation.id == conversation_id).first()
+        result = await db.execute(
+            select(Conversation).where(Conversation.id == conversation_id)
+        )
+        return result.scalars().first()
+
+    async def conversation_exists(
+        self, db: AsyncSession, conversation_id: uuid.UUID
+    ) -> bool:
+        """Check whether a conversation exists without loading it"""
+        result = await db.execute(
+            select(exists().where(Conversation.id == conversation_id))
+        )
+        return result.scalar()
 
-    def get_conversations(
-        self, db: Session, skip: int = 0, limit: int = 100
+    @staticmethod
+    def _before(timestamp_column, id_column, before: datetime, before_id: Optional[uuid.UUID]):
+        """
+        Keyset condition for the rows after (timestamp, id) in descending
+        order. The id breaks ties between rows with the same timestamp, so
+        none of them is skipped between pages.
+        """
+        if before_id is None:
+            return timestamp_column < before
+        return tuple_(timestamp_column, id_column) < tuple_(before, before_id)
+
+    async def get_conversations(
+        self,
+        db: AsyncSession,
+        before: Optional[datetime] = None,
+        before_id: Optional[uuid.UUID] = None,
+        limit: int = 100,
     ) -> List[Conversation]:
-        """Get all conversations with pagination"""
-        return db.query(Conversation).offset(skip).limit(limit).all()
-
-    def get_user_conversations(
-        self, db: Session, user_id: uuid.UUID, skip: int = 0, limit: int = 100
+        """
+        Get a page of conversations, most recently updated first. Pass the
+        updated_at and id of the last conversation of a page as before and
+        before_id to get the next.
+        """
+        query = select(Conversation).options(load_only(*CONVERSATION_LIST_COLUMNS))
+        if before is not None:
+            query = query.where(
+                self._before(Conversation.updated_at, Conversation.id, before, before_id)
+            )
+        result = await db.execute(
+            query.order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(limit)
+        )
+        return result.scalars().all()
+
+    async def get_user_conversations(
+        self,
+        db: AsyncSession,
+        user_id: uuid.UUID,
+        before: Optional[datetime] = None,
+        before_id: Optional[uuid.UUID] = None,
+        limit: int = 100,
     ) -> List[Conversation]:
-        """Get all conversations for a specific user with pagination"""
-        return (
-            db.query(Conversation)
-            .filter(Conversation.user_id == user_id)
-            .offset(skip)
-            .limit(limit)
-            .all()
+        """
+        Get a page of a user's conversations, most recently updated first. Pass
+        the updated_at and id of the last conversation of a page as before and
+        before_id to get the next.
+        """
+        query = (
+            select(Conversation)
+            .options(load_only(*CONVERSATION_LIST_COLUMNS))
+            .where(Conversation.user_id == user_id)
+        )
+        if before is not None:
+            query = query.where(
+                self._before(Conversation.updated_at, Conversation.id, before, before_id)
+            )
+        result = await db.execute(
+            query.order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(limit)
+        )
+        return result.scalars().all()
+
+    async def get_messages(
+        self,
+        db: AsyncSession,
+        conversation_id: uuid.UUID,
+        before: Optional[datetime] = None,
+        before_id: Optional[uuid.UUID] = None,
+        limit: int = 100,
+    ) -> List[Message]:
+        """
+        Get a page of the latest messages of a conversation, oldest first. Pass
+        the created_at and id of the first message of a page as before and
+        before_id to get the page of earlier messages.
+        """
+        query = (
+            select(Message)
+            .options(raiseload("*"))
+            .where(Message.conversation_id == conversation_id)
         )
+        if before is not None:
+            query = query.where(
+                self._before(Message.created_at, Message.id, before, before_id)
+            )
+        result = await db.execute(
+            query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit)
+        )
+        return list(reversed(result.scalars().all()))
 
-    def get_messages(
-        self, db: Session, conversation_id: uuid.UUID, skip: int = 0, limit: int = 100
+    async def get_recent_messages(
+        self, db: AsyncSession, conversation_id: uuid.UUID, limit: int = HISTORY_WINDOW
     ) -> List[Message]:
-        """Get all messages for a conversation with pagination"""
-        return (
-            db.query(Message)
-            .filter(Message.conversation_id == conversation_id)
-            .offset(skip)
-            .limit(limit)
-            .all()
+        """Get the latest messages of a conversation, oldest first"""
+        return await self.get_messages(db, conversation_id, limit=limit)
+
+    async def get_history_window(
+        self, db: AsyncSession, conversation_id: uuid.UUID
+    ) -> Deque[Message]:
+        """
+        Get the latest messages of a conversation in a deque bounded to the
+        model's context window, for a caller that keeps the history while
+        new messages are appended to it
+        """
+        return deque(
+            await self.get_recent_messages(db, conversation_id), maxlen=HISTORY_WINDOW
         )
 
     async def process_message(
-        self, db: Session, conversation_id: uuid.UUID, message: MessageCreate
+        self, db: AsyncSession, conversation_id: uuid.UUID, message: MessageCreate
     ) -> List[Message]:
         """
         Process a user message and generate AI responses
 
-        This method implements the full multi-layered approach:
-        1. Layer 1: Analyze the conversation and classify the query
-        2. Layer 2: Get the appropriate prompt based on analysis
-        3. Layer 3: Process the response into multiple natural messages
+        The model analyzes the conversation, picks the approach and splits
+        its response into multiple natural messages within a single request,
+        answering with a JSON object that holds the analysis and the messages.
         """
-        # Check if conversation exists
-        conversation = self.get_conversation(db, conversation_id)
-        if not conversation:
-            raise ValueError(
-                f"Conversation with ID {conversation_id} not found")
-
-        # Save user message to database
+        return [
+            db_message
+            async for db_message in self.iter_messages(db, conversation_id, message)
+        ]
+
+    async def iter_messages(
+        self, db: AsyncSession, conversation_id: uuid.UUID, message: MessageCreate
+    ) -> AsyncIterator[Message]:
+        """
+        Process a user message like process_message, yielding each AI message
+        as soon as the response processor has it. The user message is saved
+        before the model is called. The AI messages already carry their id
+        and created_at, and are saved once streaming ends, also when the
+        caller stops iterating early.
+        """
+        # Rows of a turn are stamped from this process's clock so they sort
+        # consistently
         user_message = Message(
+            id=uuid.uuid4(),
             conversation_id=conversation_id,
             content=message.content,
             sender_id=message.sender_id,
             is_user=True,
+            created_at=datetime.now(timezone.utc),
         )
-        db.add(user_message)
-        db.commit()
-        db.refresh(user_message)
 
-        # Get conversation history
-        conversation_history = self.get_messages(db, conversation_id)
+        # Get the recent conversation history used as model context. Existing
+        # history proves the conversation exists, so it is only looked up
+        # separately for the first message
+        conversation_history = await self.get_recent_messages(db, conversation_id)
+        if not conversation_history and not await self.conversation_exists(
+            db, conversation_id
+        ):
+            raise ValueError(
+                f"Conversation with ID {conversation_id} not found")
+        conversation_history.append(user_message)
+        # Save the user message up front, so it is kept if the client goes
+        # away mid-stream. The commit also ends the transaction, so the
+        # connection goes back to the pool instead of idling for the length
+        # of the model calls
+        db.add(user_message)
+        await db.commit()
 
-        # Process the message through the multi-layered approach
+        db_messages = []
         try:
-            # Layer 1: Analyze the conversation
-            analysis = await self.conversation_analyzer.analyze_conversation(
-                message.content, conversation_history
-            )
-
-            # Layer 2: Get the appropriate prompt
-            if (
-                analysis["queryType"] == "SIMPLE"
-                and analysis["recommendedApproach"] == "CONCISE"
-            ):
-                system_prompt = TherapyPrompt.get_concise_prompt()
-            else:
-                system_prompt = TherapyPrompt.get_analyzed_prompt(analysis)
-
-            # Get raw response from AI
-            raw_response = await self._get_raw_response(
-                message.content, system_prompt, conversation_history
-            )
-
-            # Layer 3: Process the response into multiple messages
-            response_messages = await self.response_processor.process_response(
-                raw_response, analysis, message.content
-            )
-
-            # Save AI responses to database
-            db_messages = []
-            for response_text in response_messages:
-                ai_message = Message(
-                    conversation_id=conversation_id,
-                    content=response_text,
-                    sender_id="AI",
-                    is_user=False,
-                )
-                db.add(ai_message)
-                db_messages.append(ai_message)
-
-            db.commit()
-            for msg in db_messages:
-                db.refresh(msg)
-
-            return db_messages
+            try:
+                message_history = self._build_chat_history(
+                    self._fused_prompt, conversation_history)
+
+                # Messages are yielded as soon as their item of the "messages"
+                # array is complete. now() is fixed for a transaction, so the
+                # replies are stamped here, a microsecond apart, to keep their order
+                replied_at = datetime.now(timezone.utc)
+                parser = self.response_processor.stream_parser()
+                response_parts = []
+
+                def reply(response_text: str) -> Message:
+                    db_message = Message(
+                        id=uuid.uuid4(),
+                        conversation_id=conversation_id,
+                        content=response_text,
+                        sender_id="AI",
+                        is_user=False,
+                        created_at=replied_at + timedelta(microseconds=len(db_messages)),
+                    )
+                    db_messages.append(db_message)
+                    return db_message
+
+                # Closed with this generator, so a disconnect also ends the
+                # upstream request
+                async with aclosing(self._stream_completion(
+                    {**self._fused_payload, "messages": message_history}
+                )) as stream:
+                    async for content in stream:
+                        response_parts.append(content)
+                        for response_text in parser.feed(content):
+                            yield reply(response_text)
+
+                response_text = "".join(response_parts)
+                if logger.isEnabledFor(logging.DEBUG):
+                    analysis = self.conversation_analyzer.parse_analysis(response_text)
+                    logger.debug(
+                        "Analysis: %s",
+                        {k: v for k, v in analysis.items() if k != "messages"},
+                    )
 
-        except Exception as e:
-            print(f"Error processing message: {str(e)}")
-            # Save error message
-            error_message = Message(
-                conversation_id=conversation_id,
-                content="Sorry, there was an error processing your message. Please try again.",
-                sender_id="AI",
-                is_user=False,
-            )
-            db.add(error_message)
-            db.commit()
-            db.refresh(error_message)
-            return [error_message]
-
-    async def _get_raw_response(
-        self, message: str, system_prompt: str, conversation_history: List[Message]
-    ) -> str:
-        """Get a raw response from the AI model"""
-        # Prepare conversation history for the API request
-        message_history = []
-
-        # Add system prompt
-        message_history.append({"role": "system", "content": system_prompt})
-
-        # Add conversation history (limited to last 10 messages to avoid token limits)
-        history_limit = 10
-        start_idx = max(0, len(conversation_history) - history_limit)
-
-        for i in range(start_idx, len(conversation_history)):
-            history_message = conversation_history[i]
-            message_history.append(
+                # Nothing parsed while streaming; fall back to the extraction
+                # methods on the complete response
+                if not db_messages:
+                    for processed_text in self.response_processor.process_response(response_text):
+                        yield reply(processed_text)
+
+            except Exception:
+                logger.exception("Error processing message")
+                if not db_messages:
+                    # Save error message
+                    error_message = Message(
+                        id=uuid.uuid4(),
+                        conversation_id=conversation_id,
+                        content="Sorry, there was an error processing your message. Please try again.",
+                        sender_id="AI",
+                        is_user=False,
+                        created_at=datetime.now(timezone.utc),
+                    )
+                    db_messages.append(error_message)
+                    yield error_message
+        finally:
+            # The generator is closed at a yield when the client disconnects;
+            # the replies it already sent are saved all the same
+            if db_messages:
+                await self._save_replies(db_messages)
+
+    async def _save_replies(self, replies: List[Message]) -> None:
+        """
+        Save the AI messages of a turn in their own session. The save runs
+        in a task shielded from the caller's cancellation, so it finishes
+        even when the request it belongs to is cancelled.
+        """
+        async def save():
+            async with SessionLocal() as db:
+                db.add_all(replies)
+                await db.commit()
+
+        task = asyncio.create_task(save())
+        self._save_tasks.add(task)
+        task.add_done_callback(self._save_tasks.discard)
+        await asyncio.shield(task)
+
+    @staticmethod
+    def _build_chat_history(
+        system_prompt: Union[str, List[Dict[str, Any]]],
+        conversation_history: Sequence[Message],
+        limit: int = HISTORY_WINDOW,
+    ) -> List[Dict[str, Any]]:
+        """
+        Build the model messages: the system prompt, as text or content
+        blocks, followed by the last messages of the history, which always
+        ends with the user's message
+        """
+        return [
+            {"role": "system", "content": system_prompt},
+            *(
                 {
                     "role": "user" if history_message.is_user else "assistant",
                     "content": history_message.content,
                 }
-            )
-
-        # Add current user message if not already in history
-        if not conversation_history or not conversation_history[-1].is_user:
-            message_history.append({"role": "user", "content": message})
-
-        # Make API request
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                self.api_endpoint,
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": self.model_name,
-                    "messages": message_history,
-                },
-                timeout=60.0,
-            )
-
+                for history_message in islice(
+                    conversation_history, max(0, len(conversation_history) - limit), None
+                )
+            ),
+        ]
+
+    async def _stream_completion(self, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        """Stream the content of a chat completion as it is generated"""
+        async with self._client.stream(
+            "POST",
+            self.api_endpoint,
+            content=orjson.dumps(payload),
+            headers=JSON_HEADERS,
+            timeout=STREAM_TIMEOUT,
+        ) as response:
             if response.status_code != 200:
-                print(
-                    f"ChatService: API request failed with status: {response.status_code}"
+                await response.aread()
+                logger.warning(
+                    "API request failed with status %s: %s",
+                    response.status_code, response.text,
                 )
-                print(f"ChatService: Response body: {response.text}")
                 raise Exception(
                     f"API request failed with status: {response.status_code}"
                 )
 
-            response_data = response.json()
-            return response_data["choices"][0]["message"]["content"]
+            async for content in iter_completion_content(response):
+                yield content
 
     async def stream_response(
-        self, websocket: WebSocket, db: Session, conversation_id: uuid.UUID, message: MessageCreate
+        self,
+        websocket: WebSocket,
+        db: AsyncSession,
+        conversation_id: uuid.UUID,
+        message: MessageCreate,
+        history: Optional[Deque[Message]] = None,
     ):
-        """Stream a response to the user's message"""
-        # Save user message to database
+        """
+        Stream a response to the user's message. A connection that keeps
+        the conversation's history window (see get_history_window) passes
+        it as history; the turn's messages are appended to it, so it is
+        not read from the database for every message.
+        """
+        # The user message is saved together with the replies. Rows of a turn
+        # are stamped from this process's clock so they sort consistently
         user_message = Message(
+            id=uuid.uuid4(),
             conversation_id=conversation_id,
             content=message.content,
             sender_id=message.sender_id,
             is_user=True,
+            created_at=datetime.now(timezone.utc),
         )
-        db.add(user_message)
-        db.commit()
-        db.refresh(user_message)
 
-        # Get conversation history
-        conversation_history = self.get_messages(db, conversation_id)
+        # Get the recent conversation history used as model context
+        if history is None:
+            history = await self.get_history_window(db, conversation_id)
+        conversation_history = history
+        conversation_history.append(user_message)
+        # Save the user message up front, so it is kept if the socket drops
+        # mid-stream. The commit also ends the transaction, so the
+        # connection goes back to the pool instead of idling for the length
+        # of the model calls
+        db.add(user_message)
+        await db.commit()
 
         try:
             # Layer 1: Analyze the conversation
             analysis = await self.conversation_analyzer.analyze_conversation(
-                message.content, conversation_history
+                message.content, conversation_history, conversation_id
             )
 
             # Layer 2: Get the appropriate prompt
             if (
-                analysis["queryType"] == "SIMPLE"
-                and analysis["recommendedApproach"] == "CONCISE"
+                analysis.get("queryType") == "SIMPLE"
+                and analysis.get("recommendedApproach") == "CONCISE"
             ):
-                system_prompt = TherapyPrompt.get_concise_prompt()
+                system_prompt = get_concise_prompt_blocks()
             else:
-                system_prompt = TherapyPrompt.get_analyzed_prompt(analysis)
-
-            # Prepare message history for streaming
-            message_history = []
-            message_history.append(
-                {"role": "system", "content": system_prompt})
-
-            # Add conversation history (limited to last 10 messages)
-            history_limit = 10
-            start_idx = max(0, len(conversation_history) - history_limit)
-
-            for i in range(start_idx, len(conversation_history)):
-                history_message = conversation_history[i]
-                message_history.append(
-                    {
-                        "role": "user" if history_message.is_user else "assistant",
-                        "content": history_message.content,
-                    }
-                )
+                system_prompt = get_analyzed_prompt_blocks(analysis)
+
+            message_history = self._build_chat_history(
+                system_prompt, conversation_history)
 
             # Make streaming API request
-            async with httpx.AsyncClient(timeout=None) as client:
-                response = await client.post(
-                    self.api_endpoint,
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json",
-                    },
-                    json={
-                        "model": self.model_name,
-                        "messages": message_history,
-                        "stream": True,
-                    },
-                    timeout=None,
-                )
+            async with self._client.stream(
+                "POST",
+                self.api_endpoint,
+                content=orjson.dumps({**self._stream_payload, "messages": message_history}),
+                headers=JSON_HEADERS,
+                timeout=STREAM_TIMEOUT,
+            ) as response:
 
                 if response.status_code != 200:
-                    await websocket.send_json(
+                    await send_json(
+                        websocket,
                         {
                             "error": f"API request failed with status: {response.status_code}"
                         }
@@ -296,36 +473,33 @@ class ChatService:
                     return
 
                 # Process the streaming response
-                buffer = ""
-                full_response = ""
-
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data = line[6:]
-                        if data == "[DONE]":
-                            break
-
-                        try:
-                            parsed = json.loads(data)
-                            content = parsed["choices"][0]["delta"].get(
-                                "content", "")
-                            if content:
-                                buffer += content
-                                full_response += content
-
-                                # Send chunks to the client
-                                await websocket.send_json(
-                                    {"type": "chunk", "content": content}
-                                )
-
-                                # If we have a complete sentence or enough characters, save as a partial message
-                                if buffer.endswith((".", "!", "?", "\n")) or len(
-                                    buffer
-                                ) > 100:
-                                    buffer = ""
-
-                        except json.JSONDecodeError:
-                            print(f"Error parsing JSON: {data}")
+                buffer = []
+                buffered_chars = 0
+                response_parts = []
+
+                async for content in iter_completion_content(response):
+                    buffer.append(content)
+                    buffered_chars += len(content)
+                    response_parts.append(content)
+
+                    # Send a chunk to the client once we have a complete
+                    # sentence or enough characters, not per token
+                    if (
+                        buffered_chars >= STREAM_CHUNK_MIN_CHARS
+                        or content.endswith((".", "!", "?", "\n"))
+                    ):
+                        await send_json(
+                            websocket, {"type": "chunk", "content": "".join(buffer)}
+                        )
+                        buffer.clear()
+                        buffered_chars = 0
+
+                # Flush whatever is left of the last sentence
+                if buffer:
+                    await send_json(
+                        websocket, {"type": "chunk", "content": "".join(buffer)}
+                    )
+                full_response = "".join(response_parts)
 
                 # Save the complete response to the database
                 ai_message = Message(
@@ -333,29 +507,33 @@ class ChatService:
                     content=full_response,
                     sender_id="AI",
                     is_user=False,
+                    created_at=datetime.now(timezone.utc),
                 )
                 db.add(ai_message)
-                db.commit()
-                db.refresh(ai_message)
+                await db.commit()
+                conversation_history.append(ai_message)
 
                 # Send completion message
-                await websocket.send_json(
-                    {"type": "complete", "message_id": str(ai_message.id)}
+                await send_json(
+                    websocket, {"type": "complete", "message_id": str(ai_message.id)}
                 )
 
-        except Exception as e:
-            print(f"Error in stream_response: {str(e)}")
-            await websocket.send_json(
-                {"error": "Sorry, there was an error processing your message."}
-            )
+        except Exception:
+            logger.exception("Error in stream_response")
 
-            # Save error message to database
+            # Save error message to database before telling the client, whose
+            # socket may be the reason for the error
             error_message = Message(
                 conversation_id=conversation_id,
                 content="Sorry, there was an error processing your message. Please try again.",
                 sender_id="AI",
                 is_user=False,
+                created_at=datetime.now(timezone.utc),
             )
             db.add(error_message)
-            db.commit()
-            db.refresh(error_message)
+            await db.commit()
+            conversation_history.append(error_message)
+
+            await send_json(
+                websocket, {"error": "Sorry, there was an error processing your message."}
+            )
@@ -1,39 +1,27 @@
-import json
+import logging
+import re
+import uuid
+from itertools import islice
 import httpx
-from typing import List, Dict, Any
+import orjson
+from cachetools import TTLCache
+from typing import List, Dict, Any, Optional, Sequence
 
-from app.core.config import settings
+from app.core.config import Settings, get_settings, settings
+from app.core.http import (
+    JSON_HEADERS,
+    CompletionConfig,
+    call_with_retry,
+    iter_completion_content,
+    openrouter_client,
+    post_with_retry,
+)
 from app.models.message import Message
+from app.services.analysis_batcher import AnalysisBatcher
 
+logger = logging.getLogger(__name__)
 
-class ConversationAnalyzer:
-    def __init__(self, api_key: str = None):
-        self.api_key = api_key or settings.OPENROUTER_API_KEY
-        self.api_endpoint = settings.OPENROUTER_API_ENDPOINT
-        # Using a smaller model for analysis
-        self.model_name = "anthropic/claude-3-haiku"
-
-        print(
-            f"ConversationAnalyzer: Initialized with API key: {self.api_key[:5]}...")
-
-    async def analyze_conversation(
-        self, message: str, conversation_history: List[Message]
-    ) -> Dict[str, Any]:
-        """
-        Analyze a conversation to determine the appropriate response approach.
-
-        Args:
-            message: The current user message to analyze
-            conversation_history: The history of previous messages
-
-        Returns:
-            A dictionary with analysis results
-        """
-        print("ConversationAnalyzer: Analyzing conversation...")
-
-        try:
-            # Prepare the system prompt for analysis
-            system_prompt = """
+_ANALYSIS_SYSTEM_PROMPT = """
 You are an AI assistant specialized in analyzing conversations to determine the appropriate response approach.
 Your task is to analyze the conversation history and the current message to determine:
 1. The type of query (SIMPLE or THERAPEUTIC)
@@ -57,93 +45,337 @@ Return a JSON object with the following fields:
 }
 """
 
-            # Prepare conversation history for the API request
-            message_history = []
-
-            # Add system prompt
-            message_history.append(
-                {"role": "system", "content": system_prompt})
-
-            # Add conversation history (limited to last 5 messages to avoid token limits)
-            history_limit = 5
-            start_idx = max(0, len(conversation_history) - history_limit)
-
-            for i in range(start_idx, len(conversation_history)):
-                history_message = conversation_history[i]
-                message_history.append({
-                    "role": "user" if history_message.is_user else "assistant",
-                    "content": history_message.content
-                })
-
-            # Add current user message if not already in history
-            if (not conversation_history or
-                conversation_history[-1].content != message or
-                    not conversation_history[-1].is_user):
-                message_history.append({"role": "user", "content": message})
-
-            # Make API request
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.api_endpoint,
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json",
-                    },
-                    json={
-                        "model": self.model_name,
-                        "messages": message_history,
-                        "temperature": 0.2,  # Low temperature for more consistent analysis
-                    },
-                    timeout=30.0,
-                )
+# Shared by every request; it is only ever read when the body is serialized
+_SYSTEM_MSG = {"role": "system", "content": _ANALYSIS_SYSTEM_PROMPT}
+
+# Greetings and small talk, as the whole of an opening message, that are
+# classified locally as simple queries without asking the model. Anything
+# else, however short, goes to the model, since a short message can still
+# be a crisis.
+_GREETING = r"(?:hi|hello|hey|hiya|howdy|good (?:morning|afternoon|evening))(?: there)?"
+_SMALL_TALK = (
+    r"(?:how are you(?: doing)?(?: today)?|how's it going|what's up"
+    r"|who are you|what can you do|what's your name|what is your name)"
+)
+_SMALL_TALK_RE = re.compile(
+    rf"(?:{_GREETING}(?:[,!.]? {_SMALL_TALK})?|{_SMALL_TALK})[!.?]*"
+)
+
+# The fields that pick the chat prompt, matched once their value is complete
+_ROUTING_FIELD_RES = {
+    field: re.compile(rf'"{field}"\s*:\s*"(\w+)"')
+    for field in ("queryType", "recommendedApproach")
+}
+
+# Analyses keyed by the conversation, the normalized message and the id of
+# the assistant message it follows, so resent or repeated messages like "ok" or "thanks"
+# at the same point of a conversation are not analyzed again
+_analysis_cache = TTLCache(maxsize=2048, ttl=settings.ANALYSIS_CACHE_TTL)
+
+_SIMPLE_ANALYSIS = {
+    "queryType": "SIMPLE",
+    "recommendedApproach": "CONCISE",
+    "emotionalState": "Neutral",
+    "conversationSummary": "",
+}
+
+
+class AnalysisParseError(ValueError):
+    """Raised when the analysis model's output holds no analysis"""
+
+
+class ConversationAnalyzer:
+    def __init__(
+        self,
+        api_key: str = None,
+        client: httpx.AsyncClient = None,
+        settings: Settings = None,
+    ):
+        self.settings = settings or get_settings()
+        self.api_key = api_key or self.settings.OPENROUTER_API_KEY
+        self.client = client or openrouter_client
+        self._headers = {"Authorization": f"Bearer {self.api_key}", **JSON_HEADERS}
+        self.api_endpoint = self.settings.OPENROUTER_API_ENDPOINT
+        self.completion_config = CompletionConfig()
+        self.batcher = AnalysisBatcher(self)
+        # Using a smaller model for analysis
+        self.model_name = "anthropic/claude-3-haiku"
+        # Only the messages change between requests
+        self._base_body = {
+            "model": self.model_name,
+            "temperature": 0.2,  # Low temperature for more consistent analysis
+        }
+        self._stream_body = {**self._base_body, "stream": True}
+
+        logger.debug("Initialized with API key: %s...", self.api_key[:5])
+
+    async def analyze_conversation(
+        self,
+        message: str,
+        conversation_history: Sequence[Message],
+        conversation_id: Optional[uuid.UUID] = None,
+    ) -> Dict[str, Any]:
+        """
+        Analyze a conversation to determine the appropriate response approach.
+
+        Args:
+            message: The current user message to analyze
+            conversation_history: The history of previous messages
+            conversation_id: The conversation analyzed; without it the
+                analysis is not cached
+
+        Returns:
+            A dictionary with analysis results
+        """
+        logger.debug("Analyzing conversation...")
+
+        fast_analysis = self._fast_classify(message, conversation_history)
+        if fast_analysis is not None:
+            logger.debug("Classified as a simple query without the model")
+            return fast_analysis
+
+        cache_key = self._cache_key(conversation_id, message, conversation_history)
+        cached_analysis = _analysis_cache.get(cache_key) if conversation_id else None
+        if cached_analysis is not None:
+            logger.debug("Reusing cached analysis")
+            return dict(cached_analysis)
+
+        try:
+            # Analyses requested at the same time are sent to the model together
+            analysis = await self.batcher.submit(
+                self._build_messages(message, conversation_history)
+            )
+            if conversation_id:
+                _analysis_cache[cache_key] = analysis
+            return dict(analysis)
+
+        except Exception:
+            logger.exception("Conversation analysis failed")
+            # Return a default analysis if an error occurs
+            return {
+                "queryType": "THERAPEUTIC",
+                "recommendedApproach": "DETAILED",
+                "emotionalState": "Unknown",
+                "conversationSummary": "Conversation analysis failed due to an error",
+            }
+
+    @staticmethod
+    def _cache_key(
+        conversation_id: Optional[uuid.UUID],
+        message: str,
+        conversation_history: Sequence[Message],
+    ) -> tuple:
+        last_assistant_id = next(
+            (
+                history_message.id
+                for history_message in reversed(conversation_history)
+                if not history_message.is_user
+            ),
+            None,
+        )
+        # The assistant message is None until the first reply, so the
+        # conversation keeps openings of different conversations apart
+        return conversation_id, message.strip().lower()[:200], last_assistant_id
+
+    @staticmethod
+    def _fast_classify(
+        message: str, conversation_history: Sequence[Message]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Classify a greeting or small talk that opens a conversation as a
+        simple query. Returns None when the model has to decide, which is
+        always the case once there is history, since even a bare "yes" can
+        answer a therapeutic question.
+        """
+        if any(
+            history_message.content != message or not history_message.is_user
+            for history_message in conversation_history
+        ):
+            return None
+        normalized = " ".join(message.lower().replace("’", "'").split())
+        if _SMALL_TALK_RE.fullmatch(normalized):
+            return dict(_SIMPLE_ANALYSIS)
+        return None
+
+    def _build_messages(
+        self, message: str, conversation_history: Sequence[Message]
+    ) -> List[Dict[str, str]]:
+        """
+        Builds the analysis model's messages: the system prompt followed by
+        the end of the conversation
+        """
+        # Prepare conversation history for the API request, starting with
+        # the system prompt
+        message_history = [_SYSTEM_MSG]
+
+        # Add conversation history (limited to last 5 messages to avoid token limits)
+        history_limit = 5
+        message_history.extend(
+            {
+                "role": "user" if history_message.is_user else "assistant",
+                "content": history_message.content,
+            }
+            for history_message in islice(
+                conversation_history, max(0, len(conversation_history) - history_limit), None
+            )
+        )
+
+        # Add current user message if not already in history
+        if (not conversation_history or
+            conversation_history[-1].content != message or
+                not conversation_history[-1].is_user):
+            message_history.append({"role": "user", "content": message})
+
+        return message_history
+
+    async def request_analysis(
+        self, message_history: List[Dict[str, str]], config: CompletionConfig = None
+    ) -> str:
+        """
+        Request a completion from the analysis model and return its text.
+
+        Args:
+            message_history: The messages to send
+            config: Timeout and retries, the analyzer's own by default
+
+        Returns:
+            The model output
+        """
+        # Make API request, retrying a slow one
+        response = await post_with_retry(
+            self.client,
+            self.api_endpoint,
+            config or self.completion_config,
+            headers=self._headers,
+            content=orjson.dumps({**self._base_body, "messages": message_history}),
+        )
+
+        if response.status_code != 200:
+            logger.warning(
+                "API request failed with status %s: %s",
+                response.status_code, response.text,
+            )
+            raise Exception(
+                f"API request failed with status: {response.status_code}")
+
+        response_data = orjson.loads(response.content)
+        analysis_text = response_data["choices"][0]["message"]["content"]
+
+        logger.debug("Received analysis: %s", analysis_text)
+        return analysis_text
+
+    async def stream_analysis(self, message_history: List[Dict[str, str]]) -> Dict[str, Any]:
+        """
+        Request an analysis with a streamed response. A simple, concise
+        query only needs the concise prompt, so the stream is closed, and
+        the generation cancelled, as soon as the routing fields show it.
+        Other analyses are read to the end, since their emotional state and
+        summary go into the prompt.
+
+        Args:
+            message_history: The messages to send
 
+        Returns:
+            A dictionary with analysis results
+        """
+
+        async def stream() -> Dict[str, Any]:
+            async with self.client.stream(
+                "POST",
+                self.api_endpoint,
+                headers=self._headers,
+                content=orjson.dumps({**self._stream_body, "messages": message_history}),
+            ) as response:
                 if response.status_code != 200:
-                    print(
-                        f"ConversationAnalyzer: API request failed with status: {response.status_code}")
-                    print(
-                        f"ConversationAnalyzer: Response body: {response.text}")
+                    await response.aread()
+                    logger.warning(
+                        "API request failed with status %s: %s",
+                        response.status_code, response.text,
+                    )
                     raise Exception(
                         f"API request failed with status: {response.status_code}")
 
-                response_data = response.json()
-                analysis_text = response_data["choices"][0]["message"]["content"]
-
-                print(
-                    f"ConversationAnalyzer: Received analysis: {analysis_text}")
-
-                # Extract the JSON object from the response
-                # The response might contain markdown or other formatting, so we need to extract just the JSON
-                try:
-                    # First try to parse the entire response as JSON
-                    analysis = json.loads(analysis_text)
-                except json.JSONDecodeError:
-                    # If that fails, try to extract JSON from the text
-                    json_start = analysis_text.find("{")
-                    json_end = analysis_text.rfind("}") + 1
-
-                    if json_start == -1 or json_end == 0:
-                        print(
-                            "ConversationAnalyzer: Failed to extract JSON from response")
-                        # Return a default analysis if JSON extraction fails
-                        return {
-                            "queryType": "THERAPEUTIC",
-                            "recommendedApproach": "DETAILED",
-                            "emotionalState": "Unknown",
-                            "conversationSummary": "Conversation analysis failed",
-                        }
-
-                    json_str = analysis_text[json_start:json_end]
-                    analysis = json.loads(json_str)
-
-                print("ConversationAnalyzer: Analysis completed successfully")
-                return analysis
-
-        except Exception as e:
-            print(f"ConversationAnalyzer ERROR: {str(e)}")
-            # Return a default analysis if an error occurs
+                analysis_text = ""
+                routing = {}
+                async for content in iter_completion_content(response):
+                    analysis_text += content
+
+                    if len(routing) < len(_ROUTING_FIELD_RES):
+                        for field, field_re in _ROUTING_FIELD_RES.items():
+                            if field not in routing and (match := field_re.search(analysis_text)):
+                                routing[field] = match.group(1)
+                        if (
+                            routing.get("queryType") == "SIMPLE"
+                            and routing.get("recommendedApproach") == "CONCISE"
+                        ):
+                            logger.debug("Simple query, closing the analysis stream early")
+                            return {**_SIMPLE_ANALYSIS, "emotionalState": ""}
+
+            logger.debug("Received analysis: %s", analysis_text)
+            analysis = self.extract_analysis(analysis_text)
+            if analysis is None:
+                # Raised rather than defaulted, so the failure is not cached
+                raise AnalysisParseError("No analysis in the model output")
+            return analysis
+
+        return await call_with_retry(stream, self.completion_config, "Analysis request")
+
+    def parse_analysis(self, analysis_text: str) -> Dict[str, Any]:
+        """
+        Parse an analysis out of model output. This is also used on the
+        fused responses of the chat service, whose JSON object carries the
+        analysis fields next to the messages.
+
+        Args:
+            analysis_text: The model output holding the analysis JSON object
+
+        Returns:
+            A dictionary with analysis results, or a default analysis if the
+            output holds none
+        """
+        analysis = self.extract_analysis(analysis_text)
+        if analysis is None:
+            # Return a default analysis if JSON extraction fails
             return {
                 "queryType": "THERAPEUTIC",
                 "recommendedApproach": "DETAILED",
                 "emotionalState": "Unknown",
-                "conversationSummary": "Conversation analysis failed due to an error",
+                "conversationSummary": "Conversation analysis failed",
             }
+        return analysis
+
+    @staticmethod
+    def extract_analysis(analysis_text: str) -> Optional[Dict[str, Any]]:
+        """
+        Extract the analysis JSON object from model output.
+
+        Args:
+            analysis_text: The model output holding the analysis JSON object
+
+        Returns:
+            A dictionary with analysis results, or None if the output holds
+            no JSON object
+        """
+        # Extract the JSON object from the response
+        # The response might contain markdown or other formatting, so we need to extract just the JSON
+        try:
+            # First try to parse the entire response as JSON
+            analysis = orjson.loads(analysis_text)
+        except orjson.JSONDecodeError:
+            # If that fails, try to extract JSON from the text
+            json_start = analysis_text.find("{")
+            json_end = analysis_text.rfind("}") + 1
+
+            try:
+                if json_start == -1 or json_end == 0:
+                    raise ValueError("No JSON object in response")
+                analysis = orjson.loads(analysis_text[json_start:json_end])
+            except ValueError:
+                analysis = None
+
+        if not isinstance(analysis, dict):
+            logger.debug("Failed to extract JSON from response")
+            return None
+
+        logger.debug("Analysis completed successfully")
+        return analysis
@@ -1,248 +1,225 @@
 import json
-import httpx
-from typing import List, Dict, Any
-
-from app.core.config import settings
+import logging
+import re
+from math import ceil
+from typing import List, Optional
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+_json_decoder = json.JSONDecoder()
+
+# Patterns of the last-resort message extraction and the fallback splitter
+_NUMBERED_MESSAGES_RE = re.compile(
+    r'(?:^|\n)(?:Message\s*)?(\d+)[:.]\s*(.*?)(?=(?:\n(?:Message\s*)?(?:\d+)[:.]\s*)|$)',
+    re.IGNORECASE | re.DOTALL
+)
+_QUOTED_MESSAGES_RE = re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"', re.DOTALL)
+
+
+def _split_paragraphs(text: str) -> List[str]:
+    """
+    Split text at blank lines, keeping the line breaks inside each paragraph.
+    Text without a newline, like most model replies that are a single
+    paragraph, is returned as is.
+    """
+    if "\n" not in text:
+        return [text]
+
+    paragraphs, lines = [], []
+    for line in text.splitlines():
+        if line.strip():
+            lines.append(line)
+        elif lines:
+            paragraphs.append("\n".join(lines))
+            lines = []
+    if lines:
+        paragraphs.append("\n".join(lines))
+    return paragraphs
+
+
+def _split_sentences(text: str) -> List[str]:
+    """
+    Split text after each '.', '!' or '?' that is followed by whitespace,
+    dropping the whitespace, in a single pass over the text.
+    """
+    sentences = []
+    start = 0
+    i = 0
+    n = len(text)
+    while i < n:
+        if text[i] in ".!?" and i + 1 < n and text[i + 1].isspace():
+            sentences.append(text[start:i + 1])
+            i += 1
+            while i < n and text[i].isspace():
+                i += 1
+            start = i
+        else:
+            i += 1
+    if start < n:
+        sentences.append(text[start:])
+    return sentences
+
+
+class _StringArrayParser:
+    """
+    Incremental parser for a JSON array of strings. Text is fed in as it
+    streams in, and each string item is returned as soon as it is closed.
+    With a key, the array is the value of that key of an enclosing object.
+    Anything before the array is skipped, as is anything after it.
+    """
+
+    def __init__(self, key: Optional[str] = None):
+        self._marker = f'"{key}"' if key else None
+        self._skipped = ""
+        self._in_array = False
+        self._in_string = False
+        self._escaped = False
+        self._done = False
+        self._item = []
+
+    def feed(self, text: str) -> List[str]:
+        if not self._in_array:
+            self._skipped += text
+            start = self._find_array_start()
+            if start == -1:
+                return []
+            self._in_array = True
+            text = self._skipped[start + 1:]
+            self._skipped = ""
+
+        items = []
+        for char in text:
+            if self._done:
+                break
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    items.append(self._decode("".join(self._item)))
+                    self._item.clear()
+                    continue
+                self._item.append(char)
+            elif char == '"':
+                self._in_string = True
+            elif char == "]":
+                self._done = True
+        return items
+
+    def _find_array_start(self) -> int:
+        if self._marker is None:
+            return self._skipped.find("[")
+        key_start = self._skipped.find(self._marker)
+        if key_start == -1:
+            return -1
+        return self._skipped.find("[", key_start + len(self._marker))
+
+    @staticmethod
+    def _decode(raw: str) -> str:
+        try:
+            # strict=False lets raw newlines inside the string through
+            return json.loads(f'"{raw}"', strict=False)
+        except json.JSONDecodeError:
+            return raw
 
 
 class ResponseProcessor:
-    def __init__(self, api_key: str = None):
-        self.api_key = api_key or settings.OPENROUTER_API_KEY
-        self.api_endpoint = settings.OPENROUTER_API_ENDPOINT
-        # Using a smaller model for processing
-        self.model_name = "anthropic/claude-3-haiku"
-
-        print(
-            f"ResponseProcessor: Initialized with API key: {self.api_key[:5]}...")
-
-    async def process_response(
-        self, raw_response: str, analysis: Dict[str, Any], user_message: str
-    ) -> List[str]:
+    """
+    Splits the chat model's response into the messages sent to the user.
+    The model writes its response as a JSON object whose "messages" array
+    holds the messages, so no separate processing request is made.
+    """
+
+    def stream_parser(self) -> _StringArrayParser:
+        """
+        Returns a parser that picks the messages out of the response as it
+        streams in, each one as soon as it is complete
+        """
+        return _StringArrayParser(key="messages")
+
+    def process_response(self, response_text: str) -> List[str]:
         """
-        Process a raw AI response into multiple natural messages.
+        Process a complete model response into multiple natural messages.
 
         Args:
-            raw_response: The raw AI response to process
-            analysis: The conversation analysis from the ConversationAnalyzer
-            user_message: The original user message
+            response_text: The model's response, ideally a JSON object with a
+                "messages" array
 
         Returns:
             A list of processed messages
         """
-        print("ResponseProcessor: Processing response...")
-
-        # For simple queries with concise approach, just return the raw response as a single message
-        if analysis["queryType"] == "SIMPLE" and analysis["recommendedApproach"] == "CONCISE":
-            print(
-                "ResponseProcessor: Simple query with concise approach, returning raw response")
-            return [raw_response]
+        logger.debug("Processing response...")
+        logger.debug("Response length: %s characters", len(response_text))
 
         try:
-            # Prepare the system prompt for processing
-            system_prompt = """
-You are an AI assistant specialized in processing therapeutic responses into multiple natural messages.
-Your task is to take a raw AI response and break it down into 2-4 separate messages that feel more natural and conversational.
-
-GUIDELINES:
-1. Break the response into 2-4 separate messages (depending on length and complexity)
-2. Each message should be self-contained and make sense on its own
-3. The messages should flow naturally as if they were sent sequentially in a conversation
-4. Preserve all the therapeutic content and advice from the original response
-5. Make the messages feel more human-like and less formal/clinical when appropriate
-6. Shorter messages (1-3 sentences) are often more natural than very long paragraphs
-7. The first message should acknowledge the user's concern
-8. The last message might include a gentle question or invitation to continue the conversation
-
-OUTPUT FORMAT:
-Your response MUST be a valid JSON array of strings, with no additional text before or after the JSON.
-The JSON array should contain 2-4 separate messages:
-
-["First message", "Second message", "Third message", "Fourth message (if needed)"]
-
-IMPORTANT: Do not include any explanations, markdown formatting, or any text outside the JSON array.
-Your entire response should be parseable as JSON. Do not include ```json``` code blocks or any other text.
-"""
-
-            # Prepare the messages for the API request
-            message_history = []
-
-            # Add system prompt
-            message_history.append(
-                {"role": "system", "content": system_prompt})
-
-            # Add context about the user's message and the raw response
-            message_history.append({
-                "role": "user",
-                "content": f"""
-USER'S MESSAGE:
-{user_message}
-
-CONVERSATION CONTEXT:
-{analysis['conversationSummary']}
-
-USER'S EMOTIONAL STATE:
-{analysis['emotionalState']}
-
-RAW AI RESPONSE TO PROCESS:
-{raw_response}
-
-Please process this into multiple natural messages.
-"""
-            })
-
-            # Make API request
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.api_endpoint,
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json",
-                    },
-                    json={
-                        "model": self.model_name,
-                        "messages": message_history,
-                        "temperature": 0.3,  # Slightly higher temperature for more natural variation
-                    },
-                    timeout=30.0,
-                )
-
-                if response.status_code != 200:
-                    print(
-                        f"ResponseProcessor: API request failed with status: {response.status_code}")
-                    print(f"ResponseProcessor: Response body: {response.text}")
-                    raise Exception(
-                        f"API request failed with status: {response.status_code}")
-
-                response_data = response.json()
-                processed_text = response_data["choices"][0]["message"]["content"]
-
-                print(
-                    f"ResponseProcessor: Received processed response: {processed_text}")
-                print(
-                    f"ResponseProcessor: Response length: {len(processed_text)} characters")
-
-                # Try to extract the JSON array using multiple methods
-                messages = self._extract_messages_from_response(processed_text)
-
-                if messages:
-                    print(
-                        f"ResponseProcessor: Successfully extracted {len(messages)} messages from JSON")
-                    return messages
-
-                print(
-                    "ResponseProcessor: JSON extraction failed, using fallback message splitter")
-                messages = self._split_message_with_fallback(raw_response)
-
-                print(
-                    f"ResponseProcessor: Processing completed with {len(messages)} messages using fallback splitter")
+            response_data = orjson.loads(response_text)
+            messages = response_data.get("messages") if isinstance(response_data, dict) else None
+            if (
+                isinstance(messages, list)
+                and messages
+                and all(isinstance(msg, str) for msg in messages)
+            ):
                 return messages
+        except orjson.JSONDecodeError:
+            logger.debug("Response is not a JSON object")
 
-        except Exception as e:
-            print(f"ResponseProcessor ERROR: {str(e)}")
-            # Use fallback message splitter instead of returning raw response
-            print("ResponseProcessor: Using fallback message splitter due to error")
-            return self._split_message_with_fallback(raw_response)
+        # Try to extract the JSON array using multiple methods
+        messages = self._extract_messages_from_response(response_text)
 
-    def _extract_messages_from_response(self, processed_text: str) -> List[str]:
-        """
-        Attempts to extract messages from the API response using multiple methods
-        """
-        try:
-            # Method 1: Try to find a JSON array using regex
-            import re
-            json_array_regex = re.compile(
-                r'\[\s*"[^"\\]*(?:\\.[^"\\]*)*"(?:\s*,\s*"[^"\\]*(?:\\.[^"\\]*)*")*\s*\]')
-            match = json_array_regex.search(processed_text)
-
-            if match:
-                json_str = match.group(0)
-                processed_messages = json.loads(json_str)
-                return [msg for msg in processed_messages]
-
-            # Method 2: Try to find the JSON array using bracket matching
-            json_start = processed_text.find('[')
-            json_end = processed_text.rfind(']') + 1
-
-            if json_start != -1 and json_end > json_start:
-                json_str = processed_text[json_start:json_end]
-                try:
-                    processed_messages = json.loads(json_str)
-                    return [msg for msg in processed_messages]
-                except json.JSONDecodeError:
-                    print(
-                        f"ResponseProcessor: Failed to parse JSON with bracket matching")
-
-                    # Try to clean the JSON string before parsing
-                    try:
-                        cleaned_json_str = self._clean_json_string(json_str)
-                        processed_messages = json.loads(cleaned_json_str)
-                        print(
-                            "ResponseProcessor: Successfully parsed JSON after cleaning")
-                        return [msg for msg in processed_messages]
-                    except json.JSONDecodeError:
-                        print(
-                            "ResponseProcessor: Failed to parse JSON even after cleaning")
-
-            # Method 3: Look for code blocks that might contain JSON
-            code_block_regex = re.compile(r'```(?:json)?\s*([\s\S]*?)\s*```')
-            print("ResponseProcessor: Checking for code blocks in response")
-            code_block_match = code_block_regex.search(processed_text)
-
-            if code_block_match and code_block_match.group(1):
-                code_content = code_block_match.group(1)
-                if code_content.strip().startswith('[') and code_content.strip().endswith(']'):
-                    try:
-                        processed_messages = json.loads(code_content.strip())
-                        return [msg for msg in processed_messages]
-                    except json.JSONDecodeError:
-                        print(
-                            "ResponseProcessor: Failed to parse JSON from code block")
-
-                        # Try to clean the JSON string before parsing
-                        try:
-                            cleaned_json_str = self._clean_json_string(
-                                code_content.strip())
-                            processed_messages = json.loads(cleaned_json_str)
-                            print(
-                                "ResponseProcessor: Successfully parsed JSON from code block after cleaning")
-                            return [msg for msg in processed_messages]
-                        except json.JSONDecodeError:
-                            print(
-                                "ResponseProcessor: Failed to parse JSON from code block even after cleaning")
-
-            # Method 4: Try to extract an array by looking for message patterns
-            print("ResponseProcessor: Trying to extract messages by pattern matching")
-            messages = self._extract_messages_by_pattern(processed_text)
-            if messages:
-                print(
-                    f"ResponseProcessor: Successfully extracted {len(messages)} messages by pattern matching")
-                return messages
+        if messages:
+            logger.debug(
+                "Successfully extracted %s messages from JSON", len(messages)
+            )
+            return messages
 
-            return []
-        except Exception as e:
-            print(
-                f"ResponseProcessor: Error in _extract_messages_from_response: {str(e)}")
-            return []
+        logger.debug("JSON extraction failed, using fallback message splitter")
+        messages = self._split_message_with_fallback(response_text)
 
-    def _clean_json_string(self, json_str: str) -> str:
-        """
-        Cleans a JSON string to make it more likely to parse correctly
-        """
-        # Replace escaped quotes with temporary markers
-        cleaned = json_str.replace('\\"', '##QUOTE##')
-
-        # Replace any unescaped internal quotes with escaped quotes
-        import re
-        cleaned = re.sub(
-            r'(?<=\[|\,)\s*"(.*?)(?<!\\)"(?=.*?(?:\,|\]))',
-            lambda match: '"' + match.group(1).replace('"', '\\"') + '"',
-            cleaned
+        logger.debug(
+            "Processing completed with %s messages using fallback splitter", len(messages)
         )
+        return messages
 
-        # Restore the originally escaped quotes
-        cleaned = cleaned.replace('##QUOTE##', '\\"')
+    def _extract_messages_from_response(self, processed_text: str) -> List[str]:
+        """
+        Attempts to extract messages from the API response: the first JSON
+        array of strings in the text, wherever it starts, or else messages
+        found by pattern matching
+        """
+        # Method 1: Decode a JSON array at each opening bracket. raw_decode
+        # parses one value in a single pass and ignores the text after it,
+        # which also covers arrays inside code blocks
+        json_start = processed_text.find('[')
+        while json_start != -1:
+            try:
+                processed_messages, _ = _json_decoder.raw_decode(processed_text, json_start)
+            except json.JSONDecodeError:
+                pass
+            else:
+                if (
+                    isinstance(processed_messages, list)
+                    and processed_messages
+                    and all(isinstance(msg, str) for msg in processed_messages)
+                ):
+                    return processed_messages
+            json_start = processed_text.find('[', json_start + 1)
+
+        logger.debug("No JSON array found in response")
+
+        # Method 2: Try to extract an array by looking for message patterns
+        logger.debug("Trying to extract messages by pattern matching")
+        messages = self._extract_messages_by_pattern(processed_text)
+        if messages:
+            logger.debug(
+                "Successfully extracted %s messages by pattern matching", len(messages)
+            )
+            return messages
 
-        return cleaned
+        return []
 
     def _extract_messages_by_pattern(self, text: str) -> List[str]:
         """
@@ -256,13 +233,7 @@ Please process this into multiple natural messages.
         messages = []
 
         # Pattern 1: Look for numbered messages with colons
-        import re
-        numbered_messages_regex = re.compile(
-            r'(?:^|\n)(?:Message\s*)?(\d+)[:.]\s*(.*?)(?=(?:\n(?:Message\s*)?(?:\d+)[:.]\s*)|$)',
-            re.IGNORECASE | re.DOTALL
-        )
-
-        matches = numbered_messages_regex.findall(text)
+        matches = _NUMBERED_MESSAGES_RE.findall(text)
         if len(matches) >= 2:
             # At least 2 messages to be worth extracting
             for _, content in matches:
@@ -274,9 +245,7 @@ Please process this into multiple natural messages.
                 return messages
 
         # Pattern 2: Look for quoted messages
-        quoted_messages_regex = re.compile(
-            r'"([^"\\]*(?:\\.[^"\\]*)*)"', re.DOTALL)
-        quoted_matches = quoted_messages_regex.findall(text)
+        quoted_matches = _QUOTED_MESSAGES_RE.findall(text)
 
         if len(quoted_matches) >= 2:
             # At least 2 messages to be worth extracting
@@ -290,7 +259,7 @@ Please process this into multiple natural messages.
                 return messages
 
         # Pattern 3: Look for paragraphs that might be separate messages
-        paragraphs = re.split(r'\n\s*\n', text)
+        paragraphs = _split_paragraphs(text)
         if 2 <= len(paragraphs) <= 4:
             return [p.strip() for p in paragraphs if p.strip()]
 
@@ -308,8 +277,7 @@ Please process this into multiple natural messages.
             return [raw_message]
 
         # Split by double newlines (paragraphs)
-        import re
-        paragraphs = re.split(r'\n\s*\n', raw_message)
+        paragraphs = _split_paragraphs(raw_message)
 
         # If we have 2-4 paragraphs, use them directly
         if 2 <= len(paragraphs) <= 4:
@@ -317,15 +285,13 @@ Please process this into multiple natural messages.
 
         # If we have more than 4 paragraphs, combine some to get 3-4 messages
         if len(paragraphs) > 4:
-            from math import min
             return self._combine_into_batches(paragraphs, min(4, len(paragraphs) // 2))
 
         # If we only have one paragraph, try to split by sentences at logical points
-        sentences = re.split(r'(?<=[.!?])\s+', raw_message)
+        sentences = _split_sentences(raw_message)
 
         if len(sentences) >= 3:
             # Try to create 2-3 balanced messages
-            from math import min
             return self._combine_into_batches(sentences, min(3, len(sentences) // 3))
 
         # If all else fails, just return the original message
@@ -341,7 +307,6 @@ Please process this into multiple natural messages.
         if num_batches == 1 or len(segments) == 1:
             return ["\n\n".join(segments)]
 
-        from math import ceil, min
         result = []
         segments_per_batch = ceil(len(segments) / num_batches)
 
@@ -1,7 +1,24 @@
-class TherapyPrompt:
-    @staticmethod
-    def get_system_prompt():
-        return '''
+from collections.abc import Mapping
+from functools import lru_cache
+
+# Fragments shared by several prompts
+_TIPP_SKILLS = 'Temperature change, Intense exercise, Paced breathing, Progressive muscle relaxation'
+_SUPPORT_GUIDELINES = (
+    'Begin with validation and empathy to establish rapport and trust',
+    "Match your tone to the user's emotional state while maintaining a calming presence",
+    'Use a warm, conversational style that feels human and genuine',
+    'Provide personalized responses rather than generic advice',
+    'Balance emotional support with practical, evidence-based strategies',
+    'Tailor therapeutic techniques to the specific concerns expressed',
+    'Offer specific, actionable suggestions rather than vague recommendations',
+)
+
+
+def _support_guidelines(indent):
+    return '\n'.join(f'{indent}- {guideline}' for guideline in _SUPPORT_GUIDELINES)
+
+
+_SYSTEM_PROMPT = f'''
 You are a compassionate AI assistant designed to provide evidence-based emotional support using therapeutic approaches from Cognitive Behavioral Therapy (CBT), Dialectical Behavior Therapy (DBT), and Acceptance and Commitment Therapy (ACT). Your purpose is to offer immediate, anonymous support to users experiencing emotional distress or seeking mental health guidance.
 
 USER CONTEXT:
@@ -19,7 +36,7 @@ THERAPEUTIC APPROACHES TO APPLY:
 
 2. DIALECTICAL BEHAVIOR THERAPY (DBT) STRATEGIES:
    - Offer mindfulness techniques to help users stay present and reduce rumination
-   - Provide distress tolerance skills for managing intense emotions (TIPP: Temperature change, Intense exercise, Paced breathing, Progressive muscle relaxation)
+   - Provide distress tolerance skills for managing intense emotions (TIPP: {_TIPP_SKILLS})
    - Suggest emotion regulation strategies to identify, understand, and manage emotions
    - Balance acceptance of current feelings with encouragement toward positive change
    - Validate the user's experiences while gently guiding toward effective coping
@@ -40,13 +57,7 @@ IDENTIFICATION AND ASSESSMENT:
 - Identify potential cognitive distortions or unhelpful thinking patterns
 
 THERAPEUTIC RESPONSE APPROACH:
-- Begin with validation and empathy to establish rapport and trust
-- Match your tone to the user's emotional state while maintaining a calming presence
-- Use a warm, conversational style that feels human and genuine
-- Provide personalized responses rather than generic advice
-- Balance emotional support with practical, evidence-based strategies
-- Tailor therapeutic techniques to the specific concerns expressed
-- Offer specific, actionable suggestions rather than vague recommendations
+{_support_guidelines("")}
 - Use examples to illustrate concepts when helpful
 
 LANGUAGE AND CULTURAL SENSITIVITY:
@@ -72,9 +83,7 @@ CRISIS RESPONSE PROTOCOL:
 Remember that your primary goal is to provide immediate, compassionate support using evidence-based approaches while recognizing the limitations of AI assistance. Always prioritize the user's wellbeing and safety above all else.
 '''.strip()
 
-    @staticmethod
-    def get_acute_distress_prompt():
-        return '''
+_ACUTE_DISTRESS_PROMPT = '''
 You are a supportive AI assistant responding to someone in acute emotional distress. Your immediate priority is to help stabilize their emotional state and ensure their safety. Respond with exceptional care and compassion.
 
 PRIORITY GUIDELINES:
@@ -98,9 +107,7 @@ PRIORITY GUIDELINES:
 Remember that your role is to provide immediate support during a difficult moment, not to solve all underlying issues. Focus on helping the user regain emotional stability and connecting them with appropriate resources.
 '''.strip()
 
-    @staticmethod
-    def get_anxiety_prompt():
-        return '''
+_ANXIETY_PROMPT = f'''
 You are a supportive AI assistant helping someone manage anxiety using evidence-based approaches. Respond with empathy and practical guidance.
 
 ANXIETY-SPECIFIC APPROACHES:
@@ -113,7 +120,7 @@ ANXIETY-SPECIFIC APPROACHES:
    - Support the creation of coping statements and alternative thoughts
 
 2. DBT SKILLS FOR ANXIETY MANAGEMENT:
-   - Teach TIPP skills for acute anxiety (Temperature change, Intense exercise, Paced breathing, Progressive muscle relaxation)
+   - Teach TIPP skills for acute anxiety ({_TIPP_SKILLS})
    - Guide through mindfulness practices to reduce rumination
    - Suggest self-soothing techniques using the five senses
    - Offer strategies for riding the wave of anxiety rather than fighting it
@@ -136,9 +143,7 @@ PRACTICAL GUIDANCE:
 Remember to balance validation of their experience with practical tools they can use immediately, while encouraging professional support for persistent anxiety.
 '''.strip()
 
-    @staticmethod
-    def get_depression_prompt():
-        return '''
+_DEPRESSION_PROMPT = '''
 You are a supportive AI assistant helping someone manage symptoms of depression using evidence-based approaches. Respond with warmth, patience, and practical guidance.
 
 DEPRESSION-SPECIFIC APPROACHES:
@@ -174,9 +179,7 @@ PRACTICAL GUIDANCE:
 Remember that depression can affect energy, motivation, and concentration, so be patient, offer simple strategies, and celebrate small steps forward. Always encourage professional support for persistent symptoms.
 '''.strip()
 
-    @staticmethod
-    def get_concise_prompt():
-        return '''
+_CONCISE_PROMPT = '''
 You are a helpful AI assistant designed to provide emotional support. Your responses to informational queries should be concise, friendly, and to the point.
 
 GUIDELINES:
@@ -190,9 +193,7 @@ GUIDELINES:
 Remember that your primary goal is to be helpful while keeping responses appropriately sized to the query complexity.
 '''.strip()
 
-    @staticmethod
-    def get_adaptive_prompt():
-        return '''
+_ADAPTIVE_PROMPT = f'''
 You are a compassionate AI assistant designed to provide evidence-based emotional support using therapeutic approaches from CBT, DBT, and ACT.
 
 RESPONSE ADAPTATION GUIDELINES:
@@ -209,30 +210,179 @@ RESPONSE ADAPTATION GUIDELINES:
    - Avoid lengthy explanations of therapeutic approaches unless specifically asked
 
 3. FOR THERAPEUTIC SUPPORT:
-   - Begin with validation and empathy to establish rapport and trust
-   - Match your tone to the user's emotional state while maintaining a calming presence
-   - Use a warm, conversational style that feels human and genuine
-   - Provide personalized responses rather than generic advice
-   - Balance emotional support with practical, evidence-based strategies
-   - Tailor therapeutic techniques to the specific concerns expressed
-   - Offer specific, actionable suggestions rather than vague recommendations
+{_support_guidelines("   ")}
 
 IMPORTANT: Your first priority is to match your response style to the user's needs. If they ask a simple question, give a simple answer. If they share emotional struggles, provide therapeutic support.
 '''.strip()
 
-    @staticmethod
-    def get_analyzed_prompt(analysis):
-        base_prompt = TherapyPrompt.get_adaptive_prompt()
-
-        return f'''
-{base_prompt}
+# Follows the adaptive prompt in an analyzed prompt
+_ANALYSIS_CONTEXT_HEAD = '''
 
 CONVERSATION CONTEXT:
-{analysis['conversationSummary']}
+'''
+# What the prompt asks for with each recommended approach; any other
+# approach gets detailed support
+_APPROACH_TEXTS = {
+    'CONCISE': 'Keep your response brief and focused.',
+    'DETAILED': 'Provide detailed therapeutic support.',
+}
+
+# Analysis and splitting instructions for single-request responses
+_FUSED_PROMPT = f'''
+{_ADAPTIVE_PROMPT}
+
+Before responding, analyze the conversation to determine:
+1. The type of query: SIMPLE (informational, factual or casual) or THERAPEUTIC (emotional support, mental health concerns or guidance on personal issues)
+2. The recommended approach: CONCISE (brief, direct, 2-4 sentences) or DETAILED (longer and more supportive, with validation and therapeutic elements)
+3. The user's emotional state
+4. A summary of the conversation context
+
+Then write your response following the recommended approach, broken into separate messages that feel natural and conversational:
+- A CONCISE response is a single message
+- A DETAILED response is 2-4 messages, each self-contained and flowing naturally as if sent one after another
+- Shorter messages (1-3 sentences) are often more natural than very long paragraphs
+- The first message should acknowledge the user's concern
+- The last message might include a gentle question or invitation to continue the conversation
+
+OUTPUT FORMAT:
+Your response MUST be a valid JSON object with the following fields, in this order, and no text before or after it:
+{{
+  "queryType": "SIMPLE" or "THERAPEUTIC",
+  "recommendedApproach": "CONCISE" or "DETAILED",
+  "emotionalState": "Brief description of user's emotional state",
+  "conversationSummary": "Brief summary of the conversation context",
+  "messages": ["First message", "Second message (if needed)"]
+}}
+'''.strip()
 
-USER'S EMOTIONAL STATE:
-{analysis['emotionalState']}
 
-RECOMMENDED APPROACH:
-{'Keep your response brief and focused.' if analysis['recommendedApproach'] == 'CONCISE' else 'Provide detailed therapeutic support.'}
-'''.strip()
+def get_system_prompt():
+    return _SYSTEM_PROMPT
+
+
+def get_acute_distress_prompt():
+    return _ACUTE_DISTRESS_PROMPT
+
+
+def get_anxiety_prompt():
+    return _ANXIETY_PROMPT
+
+
+def get_depression_prompt():
+    return _DEPRESSION_PROMPT
+
+
+def get_concise_prompt():
+    return _CONCISE_PROMPT
+
+
+def get_adaptive_prompt():
+    return _ADAPTIVE_PROMPT
+
+
+def get_analyzed_prompt(analysis):
+    fields = _analysis_fields(analysis)
+    if fields is None:
+        return _ADAPTIVE_PROMPT
+    return _build_analyzed_prompt(*fields)
+
+
+_ANALYSIS_FIELD_DEFAULTS = (
+    ('conversationSummary', ''),
+    ('emotionalState', ''),
+    ('recommendedApproach', 'DETAILED'),
+)
+
+
+def _analysis_fields(analysis):
+    # The analysis comes from model output, so it may not be an object and
+    # any field may be missing, null or of another type. The builders are
+    # cached and joined, so they are given strings only; None means the
+    # analysis is unusable and the prompt goes without it
+    if not isinstance(analysis, Mapping):
+        return None
+    fields = []
+    for key, default in _ANALYSIS_FIELD_DEFAULTS:
+        value = analysis.get(key)
+        fields.append(default if value is None else str(value))
+    return tuple(fields)
+
+
+@lru_cache(maxsize=512)
+def _build_analyzed_prompt(summary, emotional_state, approach):
+    return _ADAPTIVE_PROMPT + _build_analysis_context(summary, emotional_state, approach)
+
+
+@lru_cache(maxsize=512)
+def _build_analysis_context(summary, emotional_state, approach):
+    # Cached by value, since the same analysis recurs over the turns of a
+    # conversation
+    approach_text = _APPROACH_TEXTS.get(approach, _APPROACH_TEXTS['DETAILED'])
+    return ''.join((
+        _ANALYSIS_CONTEXT_HEAD,
+        summary,
+        "\n\nUSER'S EMOTIONAL STATE:\n",
+        emotional_state,
+        '\n\nRECOMMENDED APPROACH:\n',
+        approach_text,
+    ))
+
+
+def get_fused_prompt():
+    return _FUSED_PROMPT
+
+
+# System message content blocks. The static prompts are marked for prompt
+# caching, so the provider reuses them across the turns of a conversation
+# instead of processing them again on every request. The blocks are shared
+# between requests and only read when the body is serialized.
+def _cached_block(text):
+    return {'type': 'text', 'text': text, 'cache_control': {'type': 'ephemeral'}}
+
+
+_SYSTEM_PROMPT_BLOCKS = [_cached_block(_SYSTEM_PROMPT)]
+_CONCISE_PROMPT_BLOCKS = [_cached_block(_CONCISE_PROMPT)]
+_ADAPTIVE_PROMPT_BLOCK = _cached_block(_ADAPTIVE_PROMPT)
+_ADAPTIVE_PROMPT_BLOCKS = [_ADAPTIVE_PROMPT_BLOCK]
+_FUSED_PROMPT_BLOCKS = [_cached_block(_FUSED_PROMPT)]
+
+
+def get_system_prompt_blocks():
+    return _SYSTEM_PROMPT_BLOCKS
+
+
+def get_concise_prompt_blocks():
+    return _CONCISE_PROMPT_BLOCKS
+
+
+def get_analyzed_prompt_blocks(analysis):
+    # The adaptive prompt is cached; the analysis that follows it changes
+    # from turn to turn and is not
+    fields = _analysis_fields(analysis)
+    if fields is None:
+        return _ADAPTIVE_PROMPT_BLOCKS
+    return [
+        _ADAPTIVE_PROMPT_BLOCK,
+        {'type': 'text', 'text': _build_analysis_context(*fields)},
+    ]
+
+
+def get_fused_prompt_blocks():
+    return _FUSED_PROMPT_BLOCKS
+
+
+class TherapyPrompt:
+    """The prompt functions of this module, kept for existing callers"""
+
+    get_system_prompt = staticmethod(get_system_prompt)
+    get_acute_distress_prompt = staticmethod(get_acute_distress_prompt)
+    get_anxiety_prompt = staticmethod(get_anxiety_prompt)
+    get_depression_prompt = staticmethod(get_depression_prompt)
+    get_concise_prompt = staticmethod(get_concise_prompt)
+    get_adaptive_prompt = staticmethod(get_adaptive_prompt)
+    get_analyzed_prompt = staticmethod(get_analyzed_prompt)
+    get_fused_prompt = staticmethod(get_fused_prompt)
+    get_system_prompt_blocks = staticmethod(get_system_prompt_blocks)
+    get_concise_prompt_blocks = staticmethod(get_concise_prompt_blocks)
+    get_analyzed_prompt_blocks = staticmethod(get_analyzed_prompt_blocks)
+    get_fused_prompt_blocks = staticmethod(get_fused_prompt_blocks)
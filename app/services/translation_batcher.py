@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from typing import TYPE_CHECKING, List, Tuple
+
+import orjson
+
+from app.services.batcher import Batcher
+
+if TYPE_CHECKING:
+    from app.services.translation_service import TranslationService
+
+logger = logging.getLogger(__name__)
+
+# Most texts sent to the model in one request
+MAX_BATCH = 16
+# Seconds the first text of a language pair waits for others to join it
+BATCH_WINDOW = 0.05
+
+BATCH_INSTRUCTIONS = (
+    "Translate each item of the following JSON array on its own. Return only "
+    "a JSON array of the translations, in the same order, with no text "
+    "before or after it.\n\n"
+)
+
+LanguagePair = Tuple[str, str]
+
+
+class TranslationBatcher(Batcher):
+    """
+    Coalesces translations between the same pair of languages requested
+    within a short window into a single request, so concurrent translations
+    share one round trip and one pass over the system prompt. Each caller
+    still gets its own translation back.
+    """
+
+    max_batch = MAX_BATCH
+    batch_window = BATCH_WINDOW
+
+    def __init__(self, service: "TranslationService"):
+        super().__init__()
+        self.service = service
+
+    async def submit(self, text: str, source_language: str, target_language: str) -> str:
+        """
+        Queue a text for translation and wait for the result.
+
+        Args:
+            text: The text to translate
+            source_language: The language code of the source text
+            target_language: The language code to translate to
+
+        Returns:
+            The translated text
+        """
+        # Texts are batched per language pair
+        return await self._submit((source_language, target_language), text)
+
+    async def _process(self, pair: LanguagePair, texts: List[str]) -> List[object]:
+        if len(texts) == 1:
+            return [await self._translate(texts[0], pair)]
+        return await self._translate_batch(texts, pair)
+
+    async def _translate(self, text: str, pair: LanguagePair) -> str:
+        return await self.service.request_translation(text, *pair)
+
+    async def _translate_batch(self, texts: List[str], pair: LanguagePair) -> List[object]:
+        """
+        Translate several texts in one request. If the reply does not hold
+        one translation per text, they are translated one by one.
+        """
+        logger.debug("Translating %s texts in one request", len(texts))
+
+        try:
+            # A reply cut off by its limit raises, and the texts are then
+            # translated one by one
+            translated_text = await self.service.request_completion(
+                BATCH_INSTRUCTIONS + orjson.dumps(texts).decode(),
+                *pair,
+                self.service.batch_max_tokens(texts),
+            )
+            json_start = translated_text.find("[")
+            json_end = translated_text.rfind("]") + 1
+            translations = orjson.loads(translated_text[json_start:json_end])
+            if (
+                isinstance(translations, list)
+                and len(translations) == len(texts)
+                and all(isinstance(translation, str) for translation in translations)
+            ):
+                return translations
+            logger.warning(
+                "Batched translation returned %s results for %s texts",
+                len(translations) if isinstance(translations, list) else "no",
+                len(texts),
+            )
+        except Exception:
+            logger.exception("Batched translation failed")
+
+        return await asyncio.gather(
+            *(self._translate(text, pair) for text in texts),
+            return_exceptions=True,
+        )
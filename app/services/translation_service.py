@@ -1,18 +1,120 @@
+import hashlib
+import logging
+import re
 import httpx
-from typing import Dict, Any
+import orjson
+from cachetools import LRUCache
+from functools import lru_cache
+from typing import AsyncIterator, Dict, Any, Optional, Sequence, Tuple
 
-from app.core.config import settings
+from app.core.config import Settings, get_settings
+from app.core.http import (
+    JSON_HEADERS,
+    STREAM_TIMEOUT,
+    CircuitBreaker,
+    CircuitOpenError,
+    CompletionConfig,
+    call_with_retry,
+    is_retryable,
+    iter_completion_content,
+    openrouter_client,
+)
+from app.services.translation_batcher import TranslationBatcher
+
+logger = logging.getLogger(__name__)
+
+# Text without a letter in any script
+_NOTHING_TO_TRANSLATE_RE = re.compile(r"[\W\d_]+")
+
+# Translations skip the model while it keeps failing, returning the text
+# as it is without waiting on a request
+_circuit_breaker = CircuitBreaker("Translation")
+
+
+def _record_failure(error: Exception) -> None:
+    # Only failures that a healthy model would not have had count
+    if is_retryable(error):
+        _circuit_breaker.record_failure()
+
+
+class TranslationTruncatedError(Exception):
+    """Raised when a translation was cut off by its output limit"""
+
+
+# Stands in for the text to translate in a pre-serialized request body
+_TEXT_PLACEHOLDER = "__TEXT_TO_TRANSLATE__"
+
+# Texts at least this long are cached under a digest instead of themselves
+CACHE_KEY_DIGEST_MIN_CHARS = 4096
+
+# Recent translations, keyed by language pair and text, so repeated texts
+# like canned replies skip the request
+_translation_cache = LRUCache(maxsize=4096)
+
+# The instructions are the same for every request and are marked for
+# prompt caching; only the language pair that follows them changes
+_STATIC_PROMPT = """
+You are an AI assistant specialized in translating text between languages.
+Your task is to translate the provided text into the requested language.
+
+GUIDELINES:
+1. Translate the text accurately while preserving the meaning and tone
+2. Maintain any formatting, such as paragraphs, bullet points, or emphasis
+3. Preserve any technical terms or proper nouns that should not be translated
+4. Ensure the translation is natural and fluent in the target language
+5. If there are cultural references that don't translate well, provide appropriate equivalents
+6. For therapeutic or mental health content, ensure the translation maintains the supportive tone
+
+OUTPUT FORMAT:
+Provide only the translated text without any explanations or notes.
+"""
 
 
 class TranslationService:
-    def __init__(self, api_key: str = None):
-        self.api_key = api_key or settings.OPENROUTER_API_KEY
-        self.api_endpoint = settings.OPENROUTER_API_ENDPOINT
+    def __init__(
+        self,
+        api_key: str = None,
+        client: httpx.AsyncClient = None,
+        settings: Settings = None,
+    ):
+        self.settings = settings or get_settings()
+        self.api_key = api_key or self.settings.OPENROUTER_API_KEY
+        self.client = client or openrouter_client
+        self._headers = {"Authorization": f"Bearer {self.api_key}", **JSON_HEADERS}
+        self.batcher = TranslationBatcher(self)
+        # Rate limiting and server errors are retried as well; batched
+        # translations can take long, so the timeout stays generous, and
+        # all attempts share it
+        self.completion_config = CompletionConfig(
+            request_timeout=30.0, max_retries=2, total_timeout=30.0
+        )
+        self.api_endpoint = self.settings.OPENROUTER_API_ENDPOINT
         # Using a smaller model for translation
-        self.model_name = "anthropic/claude-3-haiku"
+        self.model_name = self.settings.TRANSLATION_MODEL
+
+        logger.debug("Initialized with API key: %s...", self.api_key[:5])
 
-        print(
-            f"TranslationService: Initialized with API key: {self.api_key[:5]}...")
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def _make_system_message(source_language: str, target_language: str) -> Dict[str, Any]:
+        """
+        Build the system message for a language pair. Messages are shared
+        between requests and only read when the body is serialized.
+        """
+        return {
+            "role": "system",
+            "content": [
+                {
+                    "type": "text",
+                    "text": _STATIC_PROMPT,
+                    "cache_control": {"type": "ephemeral"},
+                },
+                {
+                    "type": "text",
+                    "text": f"Translate from {source_language} to {target_language}.",
+                },
+            ],
+        }
 
     async def translate(self, text: str, source_language: str, target_language: str) -> str:
         """
@@ -26,74 +128,309 @@ class TranslationService:
         Returns:
             The translated text
         """
-        # Skip translation if source and target languages are the same
-        if source_language == target_language:
-            print(
-                "TranslationService: Source and target languages are the same, skipping translation")
+        # Skip translation if source and target languages are the same, or
+        # if there is nothing to translate: no text, or only digits,
+        # punctuation, symbols and whitespace
+        if (
+            not text
+            or source_language == target_language
+            or _NOTHING_TO_TRANSLATE_RE.fullmatch(text)
+        ):
             return text
 
-        print(
-            f"TranslationService: Translating from {source_language} to {target_language}")
+        logger.debug("Translating from %s to %s", source_language, target_language)
+
+        cache_key = self._cache_key(text, source_language, target_language)
+        translated_text = _translation_cache.get(cache_key)
+        if translated_text is not None:
+            logger.debug("Reusing cached translation")
+            return translated_text
+
+        if _circuit_breaker.is_open:
+            logger.debug("Translation circuit is open, returning the original text")
+            return text
 
         try:
-            # Prepare the system prompt for translation
-            system_prompt = f"""
-You are an AI assistant specialized in translating text between languages.
-Your task is to translate the provided text from {source_language} to {target_language}.
+            # Translations requested at the same time are sent to the model together
+            translated_text = await self.batcher.submit(text, source_language, target_language)
+            _translation_cache[cache_key] = translated_text
+            return translated_text
 
-GUIDELINES:
-1. Translate the text accurately while preserving the meaning and tone
-2. Maintain any formatting, such as paragraphs, bullet points, or emphasis
-3. Preserve any technical terms or proper nouns that should not be translated
-4. Ensure the translation is natural and fluent in the target language
-5. If there are cultural references that don't translate well, provide appropriate equivalents
-6. For therapeutic or mental health content, ensure the translation maintains the supportive tone
+        except Exception:
+            logger.exception("Translation failed")
+            # Return the original text if translation fails
+            return text
 
-OUTPUT FORMAT:
-Provide only the translated text without any explanations or notes.
-"""
+    async def translate_stream(
+        self, text: str, source_language: str, target_language: str
+    ) -> AsyncIterator[str]:
+        """
+        Translate text from one language to another, yielding the
+        translation in pieces as the model generates it, so a caller
+        forwarding it to the user does not wait for the whole translation.
+        Streamed translations are not batched with others; use translate()
+        when only the complete text is needed.
+
+        Args:
+            text: The text to translate
+            source_language: The language code of the source text
+            target_language: The language code to translate to
+
+        Yields:
+            Consecutive pieces of the translated text
+        """
+        if (
+            not text
+            or source_language == target_language
+            or _NOTHING_TO_TRANSLATE_RE.fullmatch(text)
+        ):
+            yield text
+            return
+
+        cache_key = self._cache_key(text, source_language, target_language)
+        translated_text = _translation_cache.get(cache_key)
+        if translated_text is not None:
+            logger.debug("Reusing cached translation")
+            yield translated_text
+            return
+
+        if _circuit_breaker.is_open:
+            logger.debug("Translation circuit is open, returning the original text")
+            yield text
+            return
 
-            # Prepare the messages for the API request
-            message_history = []
-
-            # Add system prompt
-            message_history.append(
-                {"role": "system", "content": system_prompt})
-
-            # Add the text to translate
-            message_history.append({"role": "user", "content": text})
-
-            # Make API request
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.api_endpoint,
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json",
-                    },
-                    json={
-                        "model": self.model_name,
-                        "messages": message_history,
-                        "temperature": 0.1,  # Low temperature for more accurate translation
-                    },
-                    timeout=30.0,
+        translated_parts = []
+        try:
+            async for content in self.stream_translation(text, source_language, target_language):
+                translated_parts.append(content)
+                yield content
+        except Exception:
+            logger.exception("Translation failed")
+            # Return the original text if translation fails before any of
+            # the translation was sent. A translation that failed, or was
+            # cut off, after that is not cached
+            if not translated_parts:
+                yield text
+            return
+
+        _translation_cache[cache_key] = "".join(translated_parts)
+
+    @staticmethod
+    def _cache_key(text: str, source_language: str, target_language: str) -> tuple:
+        if len(text) >= CACHE_KEY_DIGEST_MIN_CHARS:
+            # Bound the memory held by keys of long texts
+            text = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+        return source_language, target_language, text
+
+    def max_tokens(self, text: str) -> int:
+        """
+        Output limit of the translation of a single text. A translation is
+        about as long as its text, so a runaway generation is cut off
+        rather than waited for. A token is several characters long, so
+        twice the length of the text in characters leaves room for scripts
+        that need more tokens.
+        """
+        return min(max(64, 2 * len(text)), self.settings.TRANSLATION_MAX_TOKENS)
+
+    def batch_max_tokens(self, texts: Sequence[str]) -> int:
+        """Output limit of the translations of several texts in one reply"""
+        return min(
+            sum(self.max_tokens(text) for text in texts),
+            self.settings.TRANSLATION_BATCH_MAX_TOKENS,
+        )
+
+    def _build_body(
+        self,
+        text: str,
+        source_language: str,
+        target_language: str,
+        max_tokens: Optional[int],
+        stream: bool = False,
+    ) -> bytes:
+        """
+        Build the serialized request body. Everything but the text and its
+        output limit is serialized once per language pair, so a request
+        only serializes its text. A max_tokens of None leaves the output
+        unlimited.
+        """
+        prefix, suffix = self._body_template(
+            self.model_name, source_language, target_language, stream
+        )
+        return b"".join((
+            b"{" if max_tokens is None else b'{"max_tokens":%d,' % max_tokens,
+            prefix,
+            orjson.dumps(text),
+            suffix,
+        ))
+
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def _body_template(
+        model_name: str, source_language: str, target_language: str, stream: bool
+    ) -> Tuple[bytes, bytes]:
+        body = {
+            "model": model_name,
+            "temperature": 0.1,  # Low temperature for more accurate translation
+            "messages": [
+                TranslationService._make_system_message(source_language, target_language),
+                # Add the text to translate
+                {"role": "user", "content": _TEXT_PLACEHOLDER},
+            ],
+        }
+        if stream:
+            body["stream"] = True
+        prefix, _, suffix = orjson.dumps(body).partition(orjson.dumps(_TEXT_PLACEHOLDER))
+        # The opening brace comes with the output limit
+        return prefix[1:], suffix
+
+    async def request_translation(
+        self, text: str, source_language: str, target_language: str
+    ) -> str:
+        """
+        Request the translation of a single text from the model. The output
+        is limited by the length of the text; a translation cut off by the
+        limit is requested again without it.
+
+        Args:
+            text: The text to translate
+            source_language: The language code of the source text
+            target_language: The language code to translate to
+
+        Returns:
+            The translated text
+
+        Raises:
+            TranslationTruncatedError: If the translation was cut off even
+                without the limit
+        """
+        try:
+            return await self.request_completion(
+                text, source_language, target_language, self.max_tokens(text)
+            )
+        except TranslationTruncatedError:
+            logger.warning("Translation reached its output limit, retrying without it")
+            return await self.request_completion(
+                text, source_language, target_language, None
+            )
+
+    async def request_completion(
+        self,
+        text: str,
+        source_language: str,
+        target_language: str,
+        max_tokens: Optional[int],
+    ) -> str:
+        """
+        Request a translation from the model and return its text.
+
+        Args:
+            text: The user message for the model, the text to translate
+            source_language: The language code of the source text
+            target_language: The language code to translate to
+            max_tokens: The output limit, or None for no limit
+
+        Returns:
+            The model output
+
+        Raises:
+            TranslationTruncatedError: If the output was cut off by its limit
+        """
+        if _circuit_breaker.is_open:
+            raise CircuitOpenError("Translation circuit is open")
+
+        async def post() -> httpx.Response:
+            response = await self.client.post(
+                self.api_endpoint,
+                headers=self._headers,
+                content=self._build_body(text, source_language, target_language, max_tokens),
+                timeout=30.0,
+            )
+            try:
+                response.raise_for_status()
+            except httpx.HTTPStatusError:
+                logger.warning(
+                    "API request failed with status %s: %s",
+                    response.status_code, response.text,
                 )
+                raise
+            return response
 
-                if response.status_code != 200:
-                    print(
-                        f"TranslationService: API request failed with status: {response.status_code}")
-                    print(
-                        f"TranslationService: Response body: {response.text}")
-                    raise Exception(
-                        f"API request failed with status: {response.status_code}")
+        # Make API request, retrying one that failed on the way
+        try:
+            response = await call_with_retry(post, self.completion_config, "Translation request")
+        except Exception as e:
+            _record_failure(e)
+            raise
+        _circuit_breaker.record_success()
 
-                response_data = response.json()
-                translated_text = response_data["choices"][0]["message"]["content"]
+        response_data = orjson.loads(response.content)
+        choice = response_data["choices"][0]
+        if choice.get("finish_reason") == "length":
+            raise TranslationTruncatedError("Translation reached its output limit")
+        translated_text = choice["message"]["content"]
 
-                print("TranslationService: Translation completed successfully")
-                return translated_text
+        usage = response_data.get("usage") or {}
+        logger.debug(
+            "Translation prompt cache: %s tokens written, %s tokens read",
+            usage.get("cache_creation_input_tokens", 0),
+            usage.get("cache_read_input_tokens")
+            or (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0),
+        )
+
+        logger.debug("Translation completed successfully")
+        return translated_text
+
+    async def stream_translation(
+        self, text: str, source_language: str, target_language: str
+    ) -> AsyncIterator[str]:
+        """
+        Request a translation from the model with a streamed response,
+        limited by the length of the text.
 
+        Args:
+            text: The user message for the model, the text to translate
+            source_language: The language code of the source text
+            target_language: The language code to translate to
+
+        Yields:
+            The content of each streamed chunk of the model output
+
+        Raises:
+            TranslationTruncatedError: After the last chunk, if the output
+                was cut off by its limit
+        """
+        if _circuit_breaker.is_open:
+            raise CircuitOpenError("Translation circuit is open")
+
+        finish_reasons = []
+        try:
+            async with self.client.stream(
+                "POST",
+                self.api_endpoint,
+                headers=self._headers,
+                content=self._build_body(
+                    text,
+                    source_language,
+                    target_language,
+                    self.max_tokens(text),
+                    stream=True,
+                ),
+                timeout=STREAM_TIMEOUT,
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    logger.warning(
+                        "API request failed with status %s: %s",
+                        response.status_code, response.text,
+                    )
+                    response.raise_for_status()
+
+                async for content in iter_completion_content(response, finish_reasons):
+                    yield content
         except Exception as e:
-            print(f"TranslationService ERROR: {str(e)}")
-            # Return the original text if translation fails
-            return text
+            _record_failure(e)
+            raise
+        _circuit_breaker.record_success()
+
+        if "length" in finish_reasons:
+            raise TranslationTruncatedError("Translation reached its output limit")
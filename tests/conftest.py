@@ -0,0 +1,13 @@
+import os
+
+# Settings are read from the environment when app.core.config is imported;
+# the tests talk to no database or model, so placeholders will do
+for name, value in {
+    "POSTGRES_USER": "sway",
+    "POSTGRES_PASSWORD": "sway",
+    "POSTGRES_DB": "sway",
+    "POSTGRES_HOST": "localhost",
+    "POSTGRES_PORT": "5432",
+    "OPENROUTER_API_KEY": "test-key",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,44 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.chat import decode_cursor, encode_cursor
+
+
+@pytest.mark.parametrize(
+    "timestamp",
+    [
+        datetime(2025, 7, 21, 10, 30, 15, 123456, tzinfo=timezone.utc),
+        datetime(2025, 7, 21, 10, 30, tzinfo=timezone(timedelta(hours=2))),
+    ],
+)
+def test_cursor_round_trip(timestamp):
+    row_id = uuid.uuid4()
+
+    assert decode_cursor(encode_cursor(timestamp, row_id)) == (timestamp, row_id)
+
+
+def test_cursor_uses_z_for_utc():
+    cursor = encode_cursor(datetime(2025, 7, 21, tzinfo=timezone.utc), uuid.UUID(int=1))
+
+    assert cursor == "2025-07-21T00:00:00Z_00000000-0000-0000-0000-000000000001"
+
+
+def test_decode_cursor_accepts_bare_timestamp():
+    assert decode_cursor("2025-07-21T00:00:00Z") == (
+        datetime(2025, 7, 21, tzinfo=timezone.utc), None
+    )
+
+
+def test_decode_cursor_without_cursor():
+    assert decode_cursor(None) == (None, None)
+
+
+@pytest.mark.parametrize("cursor", ["junk", "2025-07-21T00:00:00Z_not-a-uuid"])
+def test_decode_cursor_rejects_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+
+    assert error.value.status_code == 422
@@ -0,0 +1,68 @@
+import asyncio
+
+from app.services.batcher import Batcher
+
+
+class _EchoBatcher(Batcher):
+    max_batch = 3
+    batch_window = 0.01
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    async def _process(self, key, items):
+        self.batches.append((key, items))
+        return [ValueError(item) if item == "bad" else f"{key}:{item}" for item in items]
+
+
+def test_batcher_coalesces_items_of_the_same_key():
+    batcher = _EchoBatcher()
+
+    async def run():
+        return await asyncio.gather(
+            batcher._submit("a", 1), batcher._submit("b", 2), batcher._submit("a", 3)
+        )
+
+    assert asyncio.run(run()) == ["a:1", "b:2", "a:3"]
+    assert sorted(batcher.batches) == [("a", [1, 3]), ("b", [2])]
+
+
+def test_batcher_flushes_a_full_batch_without_waiting():
+    batcher = _EchoBatcher()
+    batcher.batch_window = 60.0
+
+    async def run():
+        return await asyncio.wait_for(
+            asyncio.gather(*(batcher._submit("a", i) for i in range(3))), timeout=1.0
+        )
+
+    assert asyncio.run(run()) == ["a:0", "a:1", "a:2"]
+
+
+def test_batcher_routes_errors_to_their_caller():
+    batcher = _EchoBatcher()
+
+    async def run():
+        return await asyncio.gather(
+            batcher._submit("a", "good"), batcher._submit("a", "bad"), return_exceptions=True
+        )
+
+    good, bad = asyncio.run(run())
+    assert good == "a:good"
+    assert isinstance(bad, ValueError)
+
+
+def test_batcher_fails_the_whole_batch_when_processing_raises():
+    class _FailingBatcher(Batcher):
+        async def _process(self, key, items):
+            raise RuntimeError("upstream down")
+
+    batcher = _FailingBatcher()
+
+    async def run():
+        return await asyncio.gather(
+            batcher._submit(None, 1), batcher._submit(None, 2), return_exceptions=True
+        )
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(run()))
@@ -0,0 +1,77 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+import httpx
+import orjson
+import pytest
+
+from app.services.conversation_analyzer import ConversationAnalyzer
+
+
+def _message(content, is_user=True):
+    # Stands in for a Message row; the analyzer only reads these fields
+    return SimpleNamespace(id=uuid.uuid4(), content=content, is_user=is_user)
+
+
+@pytest.mark.parametrize(
+    "message",
+    ["hi", "Hello!", "hey there", "Good morning", "Hi, how are you?", "What's up", "who are you?"],
+)
+def test_fast_classify_greeting_opening_a_conversation(message):
+    analysis = ConversationAnalyzer._fast_classify(message, [_message(message)])
+
+    assert analysis["queryType"] == "SIMPLE"
+    assert analysis["recommendedApproach"] == "CONCISE"
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "I want to end it all",
+        "I cut myself again",
+        "i took all my pills",
+        "nobody would miss me",
+        "hi, I can't do this anymore",
+        "what time is it?",
+    ],
+)
+def test_fast_classify_leaves_other_short_messages_to_the_model(message):
+    assert ConversationAnalyzer._fast_classify(message, [_message(message)]) is None
+
+
+def test_fast_classify_leaves_messages_with_history_to_the_model():
+    history = [
+        _message("I haven't been sleeping"),
+        _message("Have you had thoughts of hurting yourself?", is_user=False),
+        _message("yes"),
+    ]
+
+    assert ConversationAnalyzer._fast_classify("yes", history) is None
+    assert ConversationAnalyzer._fast_classify("hi", [*history[:2], _message("hi")]) is None
+
+
+def test_parse_analysis_returns_default_for_output_without_object():
+    analysis = ConversationAnalyzer(api_key="test-key").parse_analysis("[1, 2]")
+
+    assert analysis["conversationSummary"] == "Conversation analysis failed"
+
+
+def test_analyze_conversation_does_not_cache_unparsable_analysis():
+    replies = ["Sorry, I can't help with that.", '{"queryType": "THERAPEUTIC"}']
+
+    def handler(request):
+        # The analysis is streamed as a single chunk
+        chunk = orjson.dumps({"choices": [{"delta": {"content": replies.pop(0)}}]})
+        return httpx.Response(200, content=b"data: " + chunk + b"\n\ndata: [DONE]\n\n")
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    analyzer = ConversationAnalyzer(api_key="test-key", client=client)
+    conversation_id = uuid.uuid4()
+    history = [_message("I can't sleep")]
+
+    async def analyze():
+        return await analyzer.analyze_conversation("I can't sleep", history, conversation_id)
+
+    assert asyncio.run(analyze())["emotionalState"] == "Unknown"
+    assert asyncio.run(analyze()) == {"queryType": "THERAPEUTIC"}
@@ -0,0 +1,153 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.core import http
+from app.core.http import CircuitBreaker, iter_completion_content, iter_sse_data
+
+
+class _ChunkedStream(httpx.AsyncByteStream):
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            yield chunk
+
+
+def _sse_data(*chunks):
+    async def collect():
+        response = httpx.Response(200, stream=_ChunkedStream(chunks))
+        return [data async for data in iter_sse_data(response)]
+
+    return asyncio.run(collect())
+
+
+def test_iter_sse_data_yields_data_lines():
+    assert _sse_data(b': comment\n\ndata: {"a": 1}\n\ndata: [DONE]\n\n') == [
+        b'{"a": 1}', b"[DONE]",
+    ]
+
+
+def test_iter_sse_data_strips_carriage_returns():
+    assert _sse_data(b"data: one\r\n\r\ndata: two\r\n") == [b"one", b"two"]
+
+
+def test_iter_sse_data_joins_lines_split_across_chunks():
+    # Chunks are re-read in blocks of 4096 bytes, so the line has to cross
+    # a block boundary
+    payload = b"x" * 5000
+    assert _sse_data(b"data: " + payload[:3000], payload[3000:] + b"\n\n") == [payload]
+
+
+def test_iter_sse_data_yields_last_line_without_newline():
+    assert _sse_data(b"data: one\n\ndata: last") == [b"one", b"last"]
+
+
+def test_iter_sse_data_keeps_multibyte_characters_split_across_chunks():
+    text = "é" * 3000
+    encoded = f"data: {text}\n".encode()
+    # Split in the middle of a two byte character
+    data = _sse_data(encoded[:4097], encoded[4097:])
+    assert [item.decode() for item in data] == [text]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(http.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_circuit_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker("Test", failure_threshold=3, reset_timeout=30.0)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.is_open
+    breaker.record_failure()
+    assert breaker.is_open
+
+
+def test_circuit_breaker_success_resets_failure_count(clock):
+    breaker = CircuitBreaker("Test", failure_threshold=2, reset_timeout=30.0)
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+
+def test_circuit_breaker_lets_calls_through_after_reset_timeout(clock):
+    breaker = CircuitBreaker("Test", failure_threshold=2, reset_timeout=30.0)
+    breaker.record_failure()
+    breaker.record_failure()
+
+    clock[0] += 30.0
+    assert not breaker.is_open
+
+    # The first failure after the timeout opens the circuit again
+    breaker.record_failure()
+    assert breaker.is_open
+
+
+def test_circuit_breaker_closes_on_success_after_reset_timeout(clock):
+    breaker = CircuitBreaker("Test", failure_threshold=2, reset_timeout=30.0)
+    breaker.record_failure()
+    breaker.record_failure()
+
+    clock[0] += 30.0
+    breaker.record_success()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+
+def test_iter_completion_content_yields_content_until_done():
+    async def collect():
+        response = httpx.Response(200, stream=_ChunkedStream([
+            b'data: {"choices": [{"delta": {"role": "assistant"}}]}\n\n',
+            b'data: {"choices": [{"delta": {"content": "Hel"}}]}\n\n',
+            b": OPENROUTER PROCESSING\n\n",
+            b"data: not json\n\n",
+            b'data: {"choices": [{"delta": {"content": "lo"}}]}\n\n',
+            b'data: {"choices": [], "usage": {"total_tokens": 3}}\n\n',
+            b"data: [DONE]\n\n",
+            b'data: {"choices": [{"delta": {"content": "late"}}]}\n\n',
+        ]))
+        return [content async for content in iter_completion_content(response)]
+
+    assert asyncio.run(collect()) == ["Hel", "lo"]
+
+
+def _failing_call(calls, delay):
+    async def call():
+        calls.append(None)
+        await asyncio.sleep(delay)
+        raise httpx.ConnectError("refused")
+
+    return call
+
+
+def test_call_with_retry_retries_retryable_errors():
+    calls = []
+    config = http.CompletionConfig(request_timeout=1.0, max_retries=2)
+
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(http.call_with_retry(_failing_call(calls, 0), config, "Test"))
+    assert len(calls) == 3
+
+
+def test_call_with_retry_stops_at_total_timeout():
+    calls = []
+    config = http.CompletionConfig(request_timeout=1.0, max_retries=5, total_timeout=0.3)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        with pytest.raises((httpx.ConnectError, asyncio.TimeoutError)):
+            await http.call_with_retry(_failing_call(calls, 0.2), config, "Test")
+        return loop.time() - start
+
+    assert asyncio.run(run()) < 0.5
+    assert len(calls) < 6
@@ -0,0 +1,99 @@
+import pytest
+
+from app.services.response_processor import (
+    ResponseProcessor,
+    _split_paragraphs,
+    _split_sentences,
+    _StringArrayParser,
+)
+
+
+@pytest.fixture
+def processor():
+    return ResponseProcessor()
+
+
+def test_split_message_with_fallback_splits_long_paragraph(processor):
+    # A single paragraph of many sentences is batched by sentence, which
+    # used to raise ImportError on "from math import min"
+    sentence = "This is one sentence of a long reply that keeps going on. "
+    raw_message = (sentence * 18)[:1000]
+
+    messages = processor._split_message_with_fallback(raw_message)
+
+    assert 2 <= len(messages) <= 3
+    assert all(message.strip() for message in messages)
+
+
+def test_split_message_with_fallback_keeps_short_message(processor):
+    assert processor._split_message_with_fallback("Hello there.") == ["Hello there."]
+
+
+def test_split_message_with_fallback_combines_many_paragraphs(processor):
+    raw_message = "\n\n".join(f"Paragraph {i} " + "x" * 40 for i in range(8))
+
+    messages = processor._split_message_with_fallback(raw_message)
+
+    assert len(messages) == 4
+    assert "Paragraph 0" in messages[0] and "Paragraph 7" in messages[-1]
+
+
+def test_split_paragraphs_splits_at_blank_lines():
+    text = "one\nstill one\n\n  \ntwo\n\nthree\n"
+
+    assert _split_paragraphs(text) == ["one\nstill one", "two", "three"]
+    assert _split_paragraphs("single line") == ["single line"]
+
+
+def test_split_sentences_splits_after_terminators_followed_by_space():
+    text = "Hi there. How are you?  Fine!\nOk... 3.5 is fine"
+
+    assert _split_sentences(text) == ["Hi there.", "How are you?", "Fine!", "Ok...", "3.5 is fine"]
+    assert _split_sentences("Ends here. ") == ["Ends here."]
+
+
+def test_process_response_reads_messages_array(processor):
+    response = '{"queryType": "SIMPLE", "messages": ["Hi!", "How are you?"]}'
+
+    assert processor.process_response(response) == ["Hi!", "How are you?"]
+
+
+def test_process_response_does_not_split_string_messages_into_characters(processor):
+    messages = processor.process_response('{"messages": "Hello there"}')
+
+    assert messages != list("Hello there")
+    assert all(len(message) > 1 for message in messages)
+
+
+def test_string_array_parser_yields_items_as_they_close():
+    parser = _StringArrayParser(key="messages")
+
+    assert parser.feed('{"queryType": "SIMPLE", "mess') == []
+    assert parser.feed('ages": ["Hel') == []
+    assert parser.feed('lo", "Wor') == ["Hello"]
+    assert parser.feed('ld"]}') == ["World"]
+
+
+def test_string_array_parser_decodes_escapes_split_across_feeds():
+    parser = _StringArrayParser(key="messages")
+
+    items = []
+    for piece in ['{"messages": ["Say \\', '"hi\\', '" \\u00e9', '\\n", "b"]}']:
+        items.extend(parser.feed(piece))
+
+    assert items == ['Say "hi" é\n', "b"]
+
+
+def test_string_array_parser_skips_brackets_before_key_and_text_after_array():
+    parser = _StringArrayParser(key="messages")
+
+    items = parser.feed('{"emotionalState": "[calm]", "messages": ["one"]} ["two"]')
+
+    assert items == ["one"]
+    assert parser.feed('"three"') == []
+
+
+def test_string_array_parser_without_key_reads_first_array():
+    parser = _StringArrayParser()
+
+    assert parser.feed('Here you go: ["a", "b, c"]') == ["a", "b, c"]
@@ -0,0 +1,51 @@
+import pytest
+
+from app.services.therapy_prompt import (
+    get_adaptive_prompt,
+    get_analyzed_prompt,
+    get_analyzed_prompt_blocks,
+)
+
+
+def test_analyzed_prompt_includes_analysis():
+    prompt = get_analyzed_prompt({
+        "conversationSummary": "Talking about work stress",
+        "emotionalState": "Anxious",
+        "recommendedApproach": "CONCISE",
+    })
+
+    assert prompt.startswith(get_adaptive_prompt())
+    assert "Talking about work stress" in prompt
+    assert "Anxious" in prompt
+    assert "Keep your response brief and focused." in prompt
+
+
+@pytest.mark.parametrize(
+    "analysis",
+    [
+        {},
+        {"conversationSummary": None, "emotionalState": 3, "recommendedApproach": None},
+        {"conversationSummary": ["work", "sleep"], "emotionalState": {"mood": "low"}},
+    ],
+)
+def test_analyzed_prompt_accepts_missing_and_non_string_fields(analysis):
+    prompt = get_analyzed_prompt(analysis)
+    blocks = get_analyzed_prompt_blocks(analysis)
+
+    assert "Provide detailed therapeutic support." in prompt
+    assert blocks[-1]["text"] in prompt
+
+
+def test_analyzed_prompt_stringifies_field_values():
+    prompt = get_analyzed_prompt({"conversationSummary": ["work", "sleep"], "emotionalState": 3})
+
+    assert "['work', 'sleep']" in prompt
+    assert "\n3\n" in prompt
+
+
+@pytest.mark.parametrize("analysis", [None, ["SIMPLE"], "THERAPEUTIC"])
+def test_analyzed_prompt_falls_back_to_adaptive_prompt(analysis):
+    assert get_analyzed_prompt(analysis) == get_adaptive_prompt()
+    assert [block["text"] for block in get_analyzed_prompt_blocks(analysis)] == [
+        get_adaptive_prompt()
+    ]
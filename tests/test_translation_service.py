@@ -0,0 +1,90 @@
+import asyncio
+
+import httpx
+import orjson
+import pytest
+
+from app.services import translation_service
+from app.services.translation_service import TranslationService
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    translation_service._translation_cache.clear()
+    yield
+    translation_service._translation_cache.clear()
+
+
+def _service(*replies):
+    """A service whose model answers each request with the next reply"""
+    requests = []
+    replies = list(replies)
+
+    def handler(request):
+        requests.append(orjson.loads(request.content))
+        content, finish_reason = replies.pop(0)
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": content}, "finish_reason": finish_reason}],
+        })
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return TranslationService(api_key="test-key", client=client), requests
+
+
+def test_translate_limits_output_by_the_length_of_the_text():
+    service, requests = _service(("Bonjour tout le monde", "stop"))
+
+    result = asyncio.run(service.translate("Hello everyone", "en", "fr"))
+
+    assert result == "Bonjour tout le monde"
+    assert requests[0]["max_tokens"] == service.max_tokens("Hello everyone")
+    assert requests[0]["messages"][-1]["content"] == "Hello everyone"
+
+
+def test_translate_retries_truncated_translation_without_limit():
+    service, requests = _service(("Bonjour tout", "length"), ("Bonjour tout le monde", "stop"))
+
+    result = asyncio.run(service.translate("Hello everyone", "en", "fr"))
+
+    assert result == "Bonjour tout le monde"
+    assert "max_tokens" in requests[0]
+    assert "max_tokens" not in requests[1]
+
+
+def test_translate_returns_source_and_skips_cache_when_still_truncated():
+    service, _ = _service(("Bonjour", "length"), ("Bonjour tout", "length"))
+
+    result = asyncio.run(service.translate("Hello everyone", "en", "fr"))
+
+    assert result == "Hello everyone"
+    assert len(translation_service._translation_cache) == 0
+
+
+def test_batched_translation_limit_is_the_sum_of_the_texts():
+    texts = ["Hello", "A much longer text to translate " * 10]
+    service, requests = _service((orjson.dumps(["Bonjour", "Un texte"]).decode(), "stop"))
+
+    async def run():
+        return await asyncio.gather(*(service.translate(text, "en", "fr") for text in texts))
+
+    assert asyncio.run(run()) == ["Bonjour", "Un texte"]
+    assert len(requests) == 1
+    assert requests[0]["max_tokens"] == sum(service.max_tokens(text) for text in texts)
+
+
+def test_translate_stream_does_not_cache_truncated_translation():
+    def handler(request):
+        return httpx.Response(200, content=(
+            b'data: {"choices": [{"delta": {"content": "Bonjour"}}]}\n\n'
+            b'data: {"choices": [{"delta": {"content": " tout"}, "finish_reason": "length"}]}\n\n'
+            b"data: [DONE]\n\n"
+        ))
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    service = TranslationService(api_key="test-key", client=client)
+
+    async def run():
+        return [part async for part in service.translate_stream("Hello everyone", "en", "fr")]
+
+    assert asyncio.run(run()) == ["Bonjour", " tout"]
+    assert len(translation_service._translation_cache) == 0